@@ -1,29 +1,81 @@
 import hashlib
 import json
 import os
+import threading
 import time
+from collections import OrderedDict, namedtuple
 from typing import Dict, Any, Optional, Tuple
 
+from metrics_registry import registry
+
+STAT_FIELDS = ('Health', 'Melee', 'Grenade', 'Super', 'Class', 'Weapons')
+
+# A cache hit. body is the serialized response, ready to send (already marked cached, with its age).
+CachedResponse = namedtuple("CachedResponse", ["body", "cached_at", "stale"])
+
+CACHE_LOOKUPS = registry.counter('d2forge_cache_lookups_total',
+                                 'Response cache lookups, by result (hit, stale, miss) and the tier that answered',
+                                 ['result', 'tier'])
+CACHE_EXPIRED = registry.counter('d2forge_cache_expired_total', 'Expired entries removed, by tier', ['tier'])
+CACHE_WRITES = registry.counter('d2forge_cache_writes_total', 'Responses stored')
+CACHE_EVICTIONS = registry.counter('d2forge_cache_evictions_total',
+                                   'Entries evicted to stay under the size caps, by tier', ['tier'])
+
+
 class ResponseCache:
-    """Simple file-based cache for optimization responses."""
-    
-    def __init__(self, cache_dir: str = "/tmp/d2forge_cache", ttl_seconds: int = 3600):
+    """Two-tier cache for optimization responses.
+
+    Tier 1 is an in-process LRU holding serialized response bytes, bounded by
+    entry count and total size. Tier 2 is the file cache under cache_dir:
+    writes go to a temp file and are renamed into place (readers never see a
+    partial file), and the directory is kept under max_disk_bytes by evicting
+    the oldest files.
+
+    Entries are fresh for ttl_seconds, then stale for stale_seconds more: a
+    stale hit is still served, and begin_revalidation() lets exactly one
+    caller per key recompute it in the meantime.
+
+    Expired entries are removed when a lookup finds them, by a sweep of both
+    tiers at most once per sweep_seconds (run from set(), so only processes
+    that write pay for it), by disk eviction and by the background disk index.
+
+    nearest() finds the closest cached target with the same options, whose
+    builds make good starting points for solving a new one. Entries leave its
+    index when they are evicted or expire.
+    """
+
+    def __init__(self, cache_dir: str = "/tmp/d2forge_cache", ttl_seconds: int = 3600, stale_seconds: int = 3600,
+                 max_memory_entries: int = 256, max_memory_bytes: int = 32 * 1024 * 1024,
+                 max_disk_bytes: int = 256 * 1024 * 1024, sweep_seconds: int = 600):
         self.cache_dir = cache_dir
         self.ttl_seconds = ttl_seconds  # 1 hour default
+        self.stale_seconds = stale_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.sweep_seconds = sweep_seconds
+        self._last_sweep = 0.0  # when set() last ran clear_expired()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # cache key -> (serialized response, cached_at)
+        self._memory_bytes = 0
+        self._disk_bytes = None  # running total, measured on the first write
+        self._revalidating = {}  # cache key -> time the refresh started
+        self._neighbours = {}  # options (JSON) -> {cache key: stat values}, for nearest()
+        self._neighbour_options = {}  # cache key -> its options in _neighbours
+        self._disk_indexed = False
         self._ensure_cache_dir()
-    
+
     def _ensure_cache_dir(self):
         """Create cache directory if it doesn't exist."""
         try:
             os.makedirs(self.cache_dir, exist_ok=True)
         except:
-            # If we can't create cache dir, disable caching
+            # If we can't create cache dir, the memory tier still works
             self.cache_dir = None
-    
-    def _get_cache_key(self, request_data: Dict[str, Any]) -> str:
-        """Generate a hash key for the request."""
+
+    def _cache_params(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         # Extract only the relevant optimization parameters
-        cache_params = {
+        return {
             'Health': request_data.get('Health', 0),
             'Melee': request_data.get('Melee', 0),
             'Grenade': request_data.get('Grenade', 0),
@@ -36,88 +88,420 @@ class ResponseCache:
             'exotic_perks': request_data.get('exotic_perks'),
             'minimum_constraints': request_data.get('minimum_constraints')
         }
-        
+
+    def _get_cache_key(self, request_data: Dict[str, Any]) -> str:
+        """Generate a hash key for the request."""
         # Create deterministic hash
-        cache_string = json.dumps(cache_params, sort_keys=True)
+        cache_string = json.dumps(self._cache_params(request_data), sort_keys=True)
         return hashlib.sha256(cache_string.encode()).hexdigest()
-    
+
     def _get_cache_path(self, cache_key: str) -> str:
         """Get the file path for a cache key."""
         return os.path.join(self.cache_dir, f"{cache_key}.json")
-    
-    def get(self, request_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        """Get cached response if it exists and is not expired."""
+
+    @staticmethod
+    def _serialize(response_data: Dict[str, Any]) -> bytes:
+        # Stored already marked as cached; cache_age_seconds is spliced in on each hit
+        body = dict(response_data, cached=True)
+        body.pop('cache_age_seconds', None)
+        return json.dumps(body).encode('utf-8')
+
+    def _state(self, cached_at: float) -> Optional[bool]:
+        """False if fresh, True if stale but servable, None if expired."""
+        age = time.time() - cached_at
+        if age <= self.ttl_seconds:
+            return False
+        if age <= self.ttl_seconds + self.stale_seconds:
+            return True
+        return None
+
+    # ----------------------------
+    # Memory tier
+    # ----------------------------
+
+    def _memory_put(self, cache_key: str, body: bytes, cached_at: float):
+        with self._lock:
+            old = self._memory.pop(cache_key, None)
+            if old is not None:
+                self._memory_bytes -= len(old[0])
+            if len(body) > self.max_memory_bytes:
+                return
+            self._memory[cache_key] = (body, cached_at)
+            self._memory_bytes += len(body)
+            evicted_keys = []
+            while len(self._memory) > self.max_memory_entries or self._memory_bytes > self.max_memory_bytes:
+                evicted_key, (evicted, _) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                evicted_keys.append(evicted_key)
+                CACHE_EVICTIONS.inc(tier='memory')
+        # Without a disk tier, an entry evicted from memory is gone
+        if not self.cache_dir:
+            for evicted_key in evicted_keys:
+                self._index_drop(evicted_key)
+
+    def _memory_get(self, cache_key: str) -> Optional[Tuple[bytes, float]]:
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is not None:
+                self._memory.move_to_end(cache_key)
+            return entry
+
+    def _memory_drop(self, cache_key: str):
+        with self._lock:
+            entry = self._memory.pop(cache_key, None)
+            if entry is not None:
+                self._memory_bytes -= len(entry[0])
+
+    # ----------------------------
+    # Neighbour index
+    # ----------------------------
+
+    @staticmethod
+    def _split_params(cache_params: Dict[str, Any]) -> Tuple[str, Tuple[int, ...]]:
+        """(options as JSON, stat values): requests are neighbours when their options match."""
+        options = {k: v for k, v in cache_params.items() if k not in STAT_FIELDS}
+        return json.dumps(options, sort_keys=True), tuple(cache_params[s] for s in STAT_FIELDS)
+
+    def _index_put(self, cache_key: str, cache_params: Dict[str, Any]):
+        options, stats = self._split_params(cache_params)
+        with self._lock:
+            self._neighbours.setdefault(options, {})[cache_key] = stats
+            self._neighbour_options[cache_key] = options
+
+    def _index_drop(self, cache_key: str):
+        with self._lock:
+            options = self._neighbour_options.pop(cache_key, None)
+            entries = self._neighbours.get(options)
+            if entries is not None:
+                entries.pop(cache_key, None)
+                if not entries:
+                    del self._neighbours[options]
+
+    def _index_disk(self):
+        """Start indexing entries written by earlier processes, once per process.
+
+        Runs in the background so no request waits on reading every file;
+        until it is done, nearest() sees only what this process has indexed.
+        """
+        with self._lock:
+            if self._disk_indexed:
+                return
+            self._disk_indexed = True
+        if self.cache_dir:
+            threading.Thread(target=self._read_disk_index, name="cache-index", daemon=True).start()
+
+    def _read_disk_index(self):
+        try:
+            files = self._cache_files()
+        except OSError:
+            return
+        decoder = json.JSONDecoder()
+        expires_before = time.time() - self.ttl_seconds - self.stale_seconds
+        for mtime, _, path in files:
+            if mtime < expires_before:
+                if self._disk_remove(path):
+                    CACHE_EXPIRED.inc(tier='disk')
+                continue
+            try:
+                # 'request' is written first, so the head of the file is enough
+                with open(path, 'r') as f:
+                    head = f.read(1024)
+                cache_params, _ = decoder.raw_decode(head, head.index('{', 1))
+                self._index_put(self._cache_key_of(path), cache_params)
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+
+    # ----------------------------
+    # Disk tier
+    # ----------------------------
+
+    def _disk_get(self, cache_key: str) -> Optional[Tuple[bytes, float]]:
         if not self.cache_dir:
             return None
-            
+        cache_path = self._get_cache_path(cache_key)
         try:
-            cache_key = self._get_cache_key(request_data)
-            cache_path = self._get_cache_path(cache_key)
-            
-            if not os.path.exists(cache_path):
+            # Expired files are removed without being read
+            if time.time() - os.path.getmtime(cache_path) > self.ttl_seconds + self.stale_seconds:
+                if self._disk_remove(cache_path):
+                    CACHE_EXPIRED.inc(tier='disk')
                 return None
-            
-            # Check if cache is expired
-            if time.time() - os.path.getmtime(cache_path) > self.ttl_seconds:
-                try:
-                    os.remove(cache_path)
-                except:
-                    pass
-                return None
-            
-            # Load and return cached response
             with open(cache_path, 'r') as f:
                 cached_data = json.load(f)
-                return cached_data
-                
-        except Exception:
-            # If any error occurs, just return None (cache miss)
+            return self._serialize(cached_data['response']), cached_data['cached_at']
+        except (OSError, ValueError, KeyError):
             return None
-    
-    def set(self, request_data: Dict[str, Any], response_data: Dict[str, Any]) -> bool:
-        """Cache the response data."""
+
+    def _disk_put(self, cache_key: str, cache_params: Dict[str, Any], response_data: Dict[str, Any],
+                  cached_at: float):
         if not self.cache_dir:
+            return
+        cached_data = {
+            'request': cache_params,
+            'response': response_data,
+            'cached_at': cached_at,
+            'cache_key': cache_key
+        }
+        data = json.dumps(cached_data).encode('utf-8')  # keys stay in insertion order, 'request' first
+        cache_path = self._get_cache_path(cache_key)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            previous = os.path.getsize(cache_path) if os.path.exists(cache_path) else 0
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._measure_disk()
+            else:
+                self._disk_bytes += len(data) - previous
+            over_cap = self._disk_bytes > self.max_disk_bytes
+        if over_cap:
+            self._evict_disk()
+
+    def _disk_remove(self, cache_path: str) -> bool:
+        try:
+            size = os.path.getsize(cache_path)
+            os.remove(cache_path)
+        except OSError:
             return False
-            
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+        self._index_drop(self._cache_key_of(cache_path))
+        return True
+
+    @staticmethod
+    def _cache_key_of(cache_path: str) -> str:
+        return os.path.basename(cache_path)[:-len('.json')]
+
+    def _cache_files(self):
+        """[(mtime, size, path)] for every cache file."""
+        files = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.json'):
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _measure_disk(self) -> int:
+        try:
+            return sum(size for _, size, _ in self._cache_files())
+        except OSError:
+            return 0
+
+    def _evict_disk(self):
+        """Delete expired files, then the oldest ones until the directory is back under 90% of max_disk_bytes."""
+        try:
+            files = sorted(self._cache_files())
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * 0.9
+        expires_before = time.time() - self.ttl_seconds - self.stale_seconds
+        for mtime, size, path in files:
+            expired = mtime < expires_before
+            if total <= target and not expired:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                if expired:
+                    CACHE_EXPIRED.inc(tier='disk')
+                else:
+                    CACHE_EVICTIONS.inc(tier='disk')
+            except OSError:
+                continue
+            self._index_drop(self._cache_key_of(path))
+        with self._lock:
+            self._disk_bytes = total
+
+    # ----------------------------
+    # Public interface
+    # ----------------------------
+
+    def key_for(self, request_data: Dict[str, Any]) -> str:
+        """The cache key for a request, for callers that coordinate work per key."""
+        return self._get_cache_key(request_data)
+
+    def lookup(self, request_data: Dict[str, Any], count: bool = True) -> Optional[CachedResponse]:
+        """Serialized response for this request (fresh or stale), or None on a miss.
+
+        Pass count=False when looking again for a request whose first lookup was already counted.
+        """
+        try:
+            cache_key = self._get_cache_key(request_data)
+        except (TypeError, ValueError):
+            return None
+
+        entry = self._memory_get(cache_key)
+        from_disk = entry is None
+        if from_disk:
+            entry = self._disk_get(cache_key)
+            if entry is None:
+                if count:
+                    CACHE_LOOKUPS.inc(result='miss', tier='none')
+                return None
+        body, cached_at = entry
+        tier = 'disk' if from_disk else 'memory'
+
+        stale = self._state(cached_at)
+        if stale is None:
+            self._remove(cache_key)
+            CACHE_EXPIRED.inc(tier=tier)
+            if count:
+                CACHE_LOOKUPS.inc(result='miss', tier='none')
+            return None
+        if from_disk:
+            self._memory_put(cache_key, body, cached_at)
+        if count:
+            CACHE_LOOKUPS.inc(result='stale' if stale else 'hit', tier=tier)
+
+        age = int(time.time() - cached_at)
+        body = body[:-1] + b', "cache_age_seconds": ' + str(age).encode() + b'}'
+        return CachedResponse(body, cached_at, stale)
+
+    def invalidate(self, request_data: Dict[str, Any]):
+        """Remove this request's entry from both tiers, e.g. when it can no longer be served."""
         try:
             cache_key = self._get_cache_key(request_data)
-            cache_path = self._get_cache_path(cache_key)
-            
-            # Add cache metadata
-            cached_data = {
-                'response': response_data,
-                'cached_at': time.time(),
-                'cache_key': cache_key
-            }
-            
-            # Write to cache file
-            with open(cache_path, 'w') as f:
-                json.dump(cached_data, f)
-            
+        except (TypeError, ValueError):
+            return
+        self._remove(cache_key)
+
+    def _remove(self, cache_key: str):
+        self._memory_drop(cache_key)
+        self._index_drop(cache_key)
+        if self.cache_dir:
+            self._disk_remove(self._get_cache_path(cache_key))
+
+    def get(self, request_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Get cached response if it exists and is not expired (stale entries included, flagged 'stale')."""
+        hit = self.lookup(request_data)
+        if hit is None:
+            return None
+        return {'response': json.loads(hit.body), 'cached_at': hit.cached_at, 'stale': hit.stale}
+
+    def set(self, request_data: Dict[str, Any], response_data: Dict[str, Any]) -> bool:
+        """Cache the response data in both tiers."""
+        try:
+            cache_key = self._get_cache_key(request_data)
+            cache_params = self._cache_params(request_data)
+            cached_at = time.time()
+            self._memory_put(cache_key, self._serialize(response_data), cached_at)
+            self._disk_put(cache_key, cache_params, response_data, cached_at)
+            self._index_put(cache_key, cache_params)
+            with self._lock:
+                self._revalidating.pop(cache_key, None)
+                sweep = cached_at - self._last_sweep >= self.sweep_seconds
+                if sweep:
+                    self._last_sweep = cached_at
+            CACHE_WRITES.inc()
+            if sweep:
+                self.clear_expired()
             return True
-            
+
         except Exception:
             # If caching fails, don't fail the request
             return False
-    
+
+    def nearest(self, request_data: Dict[str, Any], max_distance: int = 30) -> Optional[Tuple[Dict[str, Any], int]]:
+        """(response, distance) for the closest other cached target with the same options, or None.
+
+        Distance is the sum of absolute stat differences; targets farther than
+        max_distance are ignored.
+        """
+        self._index_disk()
+        try:
+            options, stats = self._split_params(self._cache_params(request_data))
+            with self._lock:
+                candidates = sorted(
+                    (sum(abs(a - b) for a, b in zip(stats, other)), cache_key)
+                    for cache_key, other in self._neighbours.get(options, {}).items()
+                )
+        except (TypeError, ValueError):
+            return None
+        for distance, cache_key in candidates:
+            if distance > max_distance:
+                break
+            if distance == 0:
+                continue
+            entry = self._memory_get(cache_key) or self._disk_get(cache_key)
+            if entry is None or self._state(entry[1]) is None:
+                self._index_drop(cache_key)
+                continue
+            return json.loads(entry[0]), distance
+        return None
+
+    def begin_revalidation(self, request_data: Dict[str, Any], timeout_seconds: int = 120) -> bool:
+        """Claim the refresh of a stale entry; True for one caller per key until set(), end_revalidation() or the timeout."""
+        cache_key = self._get_cache_key(request_data)
+        now = time.time()
+        with self._lock:
+            started = self._revalidating.get(cache_key)
+            if started is not None and now - started < timeout_seconds:
+                return False
+            self._revalidating[cache_key] = now
+            return True
+
+    def end_revalidation(self, request_data: Dict[str, Any]):
+        """Give up a begin_revalidation() claim, so the next stale hit can try again."""
+        cache_key = self._get_cache_key(request_data)
+        with self._lock:
+            self._revalidating.pop(cache_key, None)
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """(entries, bytes) held in this process's memory tier."""
+        with self._lock:
+            return len(self._memory), self._memory_bytes
+
+    def disk_usage(self) -> Tuple[int, int]:
+        """(files, bytes) in the cache directory, measured now (it is shared by every process on the host)."""
+        if not self.cache_dir:
+            return 0, 0
+        try:
+            files = self._cache_files()
+        except OSError:
+            return 0, 0
+        return len(files), sum(size for _, size, _ in files)
+
     def clear_expired(self):
         """Clear expired cache entries."""
+        with self._lock:
+            expired = [k for k, (_, cached_at) in self._memory.items() if self._state(cached_at) is None]
+        for cache_key in expired:
+            self._memory_drop(cache_key)
+            if not self.cache_dir:
+                self._index_drop(cache_key)
+            CACHE_EXPIRED.inc(tier='memory')
+
         if not self.cache_dir:
             return
-            
+
         try:
             current_time = time.time()
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json'):
-                    filepath = os.path.join(self.cache_dir, filename)
-                    if current_time - os.path.getmtime(filepath) > self.ttl_seconds:
-                        try:
-                            os.remove(filepath)
-                        except:
-                            pass
+            for mtime, _, filepath in self._cache_files():
+                if current_time - mtime > self.ttl_seconds + self.stale_seconds and self._disk_remove(filepath):
+                    CACHE_EXPIRED.inc(tier='disk')
         except Exception:
             pass
 
 # Global cache instance
-# Set TTL to 2 hours for optimization responses since they're deterministic
-optimization_cache = ResponseCache(ttl_seconds=7200)
\ No newline at end of file
+# Set TTL to 2 hours for optimization responses since they're deterministic;
+# stale entries are served for another 2 hours while one request refreshes them
+optimization_cache = ResponseCache(ttl_seconds=7200, stale_seconds=7200)
+
+registry.gauge('d2forge_cache_memory_entries', "Responses in the processes' memory tiers",
+               function=lambda: optimization_cache.memory_usage()[0])
+registry.gauge('d2forge_cache_memory_bytes', "Bytes in the processes' memory tiers",
+               function=lambda: optimization_cache.memory_usage()[1])
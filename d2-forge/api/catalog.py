@@ -0,0 +1,54 @@
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+import sys
+import os
+
+# Add the current directory to Python path so we can import our modules
+sys.path.append(os.path.dirname(__file__))
+
+from main import catalog_key
+from http_response import send_static
+from optimize import catalog_options, catalog_wire
+
+def options_from_query(path):
+    """Catalog options from a query string, spelled like the /api/optimize body fields."""
+    query = parse_qs(urlsplit(path).query)
+
+    def flag(name, default):
+        values = query.get(name)
+        return default if not values else values[-1].strip().lower() in ('1', 'true', 'yes')
+
+    return {
+        'allow_tuned': flag('allow_tuned', True),
+        'use_exotic': flag('use_exotic', False),
+        'use_class_item_exotic': flag('use_class_item_exotic', False),
+        'exotic_perks': query.get('exotic_perks'),
+    }
+
+class handler(BaseHTTPRequestHandler):
+    """GET /api/catalog?allow_tuned=..&use_exotic=..&use_class_item_exotic=..&exotic_perks=A&exotic_perks=B
+
+    The piece table that v2 /api/optimize responses index into:
+    {"version": 2, "id": ..., "fields": [...], "pieces": [[...], ...]}. A
+    piece's id is its position in "pieces". v2 responses carry the id and
+    href of the catalog they use, so clients fetch each one once and keep it.
+    """
+
+    def do_GET(self):
+        try:
+            try:
+                key = catalog_key(**catalog_options(options_from_query(self.path)))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            send_static(self, catalog_wire(key).document)
+        except Exception as e:
+            self.send_error(500, f"Failed to get piece catalog: {str(e)}")
+
+    def do_OPTIONS(self):
+        # Handle CORS preflight
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.end_headers()
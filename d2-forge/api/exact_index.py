@@ -0,0 +1,271 @@
+"""
+Prebuilt roll-sum index for the exact-match engine, shipped as a memory-mapped file.
+
+The roll-sum tables in exact_solver only depend on the armor constants in
+main.py, never on the request, so they are enumerated offline:
+
+    python api/exact_index.py            # writes api/data/exact_index.bin
+
+Exotic rolls are a single vector per configuration and are resolved from the
+catalog at query time, so one artifact serves every generate_piece_types
+configuration, including each CLASS_ITEM_ROLLS entry. The build checks that
+all of them decompose onto the stored rolls.
+
+File layout (little-endian): b"D2FX", u32 header length, JSON header, then
+8-byte aligned arrays. Per table: sorted distinct u64 keys, u32 start offsets
+(one per key plus a sentinel), u8 roll ids (n per multiset) and, for
+balanced tables, the u64 packed sum of each multiset. Within a key,
+multisets with fewer distinct rolls (easier builds) come first.
+"""
+
+from bisect import bisect_left
+from itertools import combinations_with_replacement
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from main import (STAT_NAMES, ARCHETYPES, PRIMARY_VAL, SECONDARY_VAL, TERTIARY_VAL, BASE_FIVE, STANDARD_MOD_VAL,
+                  TUNING_VAL, MAX_PER_PIECE, EXOTIC_SECONDARY_VAL, EXOTIC_TERTIARY_VAL, CLASS_ITEM_ROLLS,
+                  get_piece_catalog)
+
+LANE_BITS = 10
+FORMAT_VERSION = 1
+MAGIC = b"D2FX"
+MAX_ROLLS_PER_BUILD = 5
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(__file__), "data", "exact_index.bin")
+
+
+def pack(vec):
+    """Pack a stat vector into one int. Linear, so pack(a) - pack(b) == pack(a - b)."""
+    key = 0
+    for i, v in enumerate(vec):
+        key += v << (LANE_BITS * i)
+    return key
+
+
+def index_fingerprint():
+    """Hash of every constant the stored tables depend on; a mismatch marks the file stale."""
+    constants = {
+        "format": FORMAT_VERSION,
+        "lane_bits": LANE_BITS,
+        "stat_names": STAT_NAMES,
+        "archetypes": [list(a) for a in ARCHETYPES],
+        "PRIMARY_VAL": PRIMARY_VAL,
+        "SECONDARY_VAL": SECONDARY_VAL,
+        "TERTIARY_VAL": TERTIARY_VAL,
+        "BASE_FIVE": BASE_FIVE,
+        "STANDARD_MOD_VAL": STANDARD_MOD_VAL,
+        "TUNING_VAL": TUNING_VAL,
+        "MAX_PER_PIECE": MAX_PER_PIECE,
+        "EXOTIC_SECONDARY_VAL": EXOTIC_SECONDARY_VAL,
+        "EXOTIC_TERTIARY_VAL": EXOTIC_TERTIARY_VAL,
+    }
+    return hashlib.sha256(json.dumps(constants, sort_keys=True).encode()).hexdigest()
+
+
+def _by_ease(combos):
+    return sorted(combos, key=lambda combo: len(set(combo)))
+
+
+def build_flat_sums(rolls, vectors, n):
+    """packed sum -> list of sorted n-roll multisets, easiest first."""
+    table = {}
+    keys = {r: pack(vectors[r]) for r in rolls}
+    for combo in combinations_with_replacement(rolls, n):
+        table.setdefault(sum(keys[r] for r in combo), []).append(combo)
+    return {key: _by_ease(combos) for key, combos in table.items()}
+
+
+def build_balanced_sums(rolls, vectors, n, step):
+    """packed residue (mod step) -> list of (n-roll multiset, packed sum), easiest first."""
+    table = {}
+    for combo in combinations_with_replacement(rolls, n):
+        vec = [sum(vectors[r][i] for r in combo) for i in range(len(STAT_NAMES))]
+        table.setdefault(pack([v % step for v in vec]), []).append((combo, pack(vec)))
+    return {key: sorted(entries, key=lambda e: len(set(e[0]))) for key, entries in table.items()}
+
+
+# ----------------------------
+# Writing
+# ----------------------------
+
+def write_index(path, flat_rolls, balanced_rolls, vectors):
+    """Enumerate every flat/balanced roll table and write them to path atomically."""
+    roll_ids = {r: i for i, r in enumerate(flat_rolls)}
+    roll_ids.update({r: i for i, r in enumerate(balanced_rolls)})
+    header = {
+        "version": FORMAT_VERSION,
+        "fingerprint": index_fingerprint(),
+        "flat_rolls": [[r[0], r[1], r[2], list(vectors[r])] for r in flat_rolls],
+        "balanced_rolls": [[r[0], r[1], r[2], list(vectors[r])] for r in balanced_rolls],
+        "tables": {},
+    }
+    blobs = []
+    offset = 0
+
+    def add(fmt, values):
+        nonlocal offset
+        data = struct.pack(f"<{len(values)}{fmt}", *values)
+        data += b"\0" * (-len(data) % 8)
+        blobs.append(data)
+        start = offset
+        offset += len(data)
+        return [start, len(values)]
+
+    for n in range(1, MAX_ROLLS_PER_BUILD + 1):
+        flat = build_flat_sums(flat_rolls, vectors, n)
+        keys = sorted(flat)
+        starts, ids = [0], []
+        for key in keys:
+            for combo in flat[key]:
+                ids.extend(roll_ids[r] for r in combo)
+            starts.append(len(ids) // n)
+        header["tables"][f"flat/{n}"] = {"keys": add("Q", keys), "starts": add("I", starts), "ids": add("B", ids)}
+
+        balanced = build_balanced_sums(balanced_rolls, vectors, n, TUNING_VAL)
+        keys = sorted(balanced)
+        starts, ids, sums = [0], [], []
+        for key in keys:
+            for combo, combo_key in balanced[key]:
+                ids.extend(roll_ids[r] for r in combo)
+                sums.append(combo_key)
+            starts.append(len(sums))
+        header["tables"][f"balanced/{n}"] = {"keys": add("Q", keys), "starts": add("I", starts),
+                                             "ids": add("B", ids), "sums": add("Q", sums)}
+
+    header_bytes = json.dumps(header).encode()
+    prefix = MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+    prefix += b"\0" * (-len(prefix) % 8)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+# ----------------------------
+# Reading
+# ----------------------------
+
+class _MappedTable:
+    """Read-only dict-like view of one table; get() is a binary search over the mapped keys."""
+
+    def __init__(self, view, spec, n, rolls):
+        self._keys = self._array(view, spec["keys"], "Q")
+        self._starts = self._array(view, spec["starts"], "I")
+        self._ids = self._array(view, spec["ids"], "B")
+        self._sums = self._array(view, spec["sums"], "Q") if "sums" in spec else None
+        self._n = n
+        self._rolls = rolls
+
+    @staticmethod
+    def _array(view, location, fmt):
+        start, count = location
+        return view[start:start + count * struct.calcsize(fmt)].cast(fmt)
+
+    def get(self, key, default=None):
+        if key < 0 or key >= 1 << 64:
+            return default
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            return default
+        n, ids, rolls = self._n, self._ids, self._rolls
+        combos = [tuple(rolls[r] for r in ids[j * n:(j + 1) * n])
+                  for j in range(self._starts[i], self._starts[i + 1])]
+        if self._sums is None:
+            return combos
+        return list(zip(combos, self._sums[self._starts[i]:self._starts[i + 1]]))
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class MappedIndex:
+    """A loaded index file. Tables are views over the mapping and are never copied."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:4] != MAGIC:
+            raise ValueError(f"{path} is not an exact index")
+        (header_len,) = struct.unpack_from("<I", self._mmap, 4)
+        header = json.loads(self._mmap[8:8 + header_len])
+        if header.get("version") != FORMAT_VERSION or header.get("fingerprint") != index_fingerprint():
+            raise ValueError(f"{path} was built from different constants; rebuild it")
+
+        data_start = 8 + header_len + (-(8 + header_len) % 8)
+        view = memoryview(self._mmap)[data_start:]
+        self.vectors = {}
+        self.flat_rolls = self._rolls(header["flat_rolls"])
+        self.balanced_rolls = self._rolls(header["balanced_rolls"])
+        self._flat = {}
+        self._balanced = {}
+        for name, spec in header["tables"].items():
+            kind, n = name.split("/")
+            n = int(n)
+            if kind == "flat":
+                self._flat[n] = _MappedTable(view, spec, n, self.flat_rolls)
+            else:
+                self._balanced[n] = _MappedTable(view, spec, n, self.balanced_rolls)
+
+    def _rolls(self, entries):
+        rolls = []
+        for arch, tertiary, balanced, vec in entries:
+            roll = (arch, tertiary, balanced)
+            self.vectors[roll] = tuple(vec)
+            rolls.append(roll)
+        return rolls
+
+    def flat_sums(self, n):
+        if n == 0:
+            return {0: [()]}
+        return self._flat[n]
+
+    def balanced_sums(self, n):
+        return self._balanced[n]
+
+
+_load_lock = threading.Lock()
+_loaded = {}
+
+
+def load_index(path=DEFAULT_INDEX_PATH):
+    """Shared MappedIndex for path, or None if the file is missing, corrupt or stale."""
+    with _load_lock:
+        if path not in _loaded:
+            try:
+                _loaded[path] = MappedIndex(path)
+            except (OSError, ValueError, KeyError):
+                _loaded[path] = None
+        return _loaded[path]
+
+
+# ----------------------------
+# Build step
+# ----------------------------
+if __name__ == "__main__":
+    from exact_solver import ExactIndex
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INDEX_PATH
+    reference = ExactIndex(get_piece_catalog(True), use_artifact=False)
+
+    # Every configuration must share the stored flat/balanced rolls
+    configs = [dict(allow_tuned=t) for t in (True, False)]
+    configs += [dict(allow_tuned=t, use_exotic=True) for t in (True, False)]
+    configs += [dict(allow_tuned=t, use_exotic=True, use_class_item_exotic=True, exotic_perks=perks)
+                for t in (True, False) for perks in CLASS_ITEM_ROLLS]
+    for config in configs:
+        index = ExactIndex(get_piece_catalog(**config), use_artifact=False)
+        if not index.supported or index.flat_rolls != reference.flat_rolls \
+                or index.balanced_rolls != reference.balanced_rolls:
+            sys.exit(f"configuration {config} does not decompose onto the shared rolls")
+
+    write_index(path, reference.flat_rolls, reference.balanced_rolls, reference.rolls)
+    print(f"Wrote {path} ({os.path.getsize(path)} bytes, {len(configs)} configurations checked)")
@@ -0,0 +1,283 @@
+"""
+Exact-match engine that answers Phase 1 queries without starting CBC.
+
+Every piece in a catalog is a roll (archetype + tertiary, optionally with
+Balanced Tuning, or an exotic roll) plus one +10 mod and at most one +5/-5
+tuning. Any 5-piece build therefore totals
+
+    (sum of 5 rolls) + 10 * (mod targets) + 5 * (net tuning)
+
+The two halves are indexed separately: roll sums once per catalog, and the
+mod/tuning overlays once per process. An exact query then becomes a
+meet-in-the-middle join of dictionary lookups. Vectors are packed into
+integers (one 10-bit lane per stat), so a lookup key is a single subtraction.
+"""
+
+from collections import namedtuple
+from itertools import combinations_with_replacement
+import threading
+
+from main import STAT_NAMES, STANDARD_MOD_VAL, TUNING_VAL, difficulty_score, is_exotic_piece, normalize_solution
+from exact_index import pack, build_flat_sums, build_balanced_sums, load_index
+
+PIECES = 5
+# Overlays with more tuned pieces than this are left to CBC
+MAX_TUNED_SLOTS = 2
+# Upper bound on dictionary probes per query; trades tuned-slot depth for latency
+LOOKUP_BUDGET = 250_000
+
+# One +10 mod per slot and the +5/-5 tunings, as stat indices
+Overlay = namedtuple("Overlay", ["mods", "tunings"])
+
+
+_overlay_lock = threading.Lock()
+_overlay_levels = None
+
+
+def overlay_levels():
+    """Distinct overlay offsets grouped by tuned-slot count: [[(packed offset, Overlay), ...], ...].
+
+    Each offset is kept once, under the representation that uses the fewest
+    tuned pieces. The table only depends on the stat count and mod values.
+    """
+    global _overlay_levels
+    with _overlay_lock:
+        if _overlay_levels is None:
+            n = len(STAT_NAMES)
+            unit = [[0] * n for _ in range(n)]
+            for i in range(n):
+                unit[i][i] = 1
+            mod_sets = [(mods, pack([STANDARD_MOD_VAL * sum(unit[m][i] for m in mods) for i in range(n)]))
+                        for mods in combinations_with_replacement(range(n), PIECES)]
+            pairs = [(t, d) for t in range(n) for d in range(n) if t != d]
+            pair_keys = {(t, d): (pack(unit[t]) - pack(unit[d])) * TUNING_VAL for t, d in pairs}
+
+            seen = set()
+            levels = []
+            for k in range(MAX_TUNED_SLOTS + 1):
+                level = []
+                for tunings in combinations_with_replacement(pairs, k):
+                    tuning_key = sum(pair_keys[pair] for pair in tunings)
+                    for mods, mod_key in mod_sets:
+                        key = mod_key + tuning_key
+                        if key not in seen:
+                            seen.add(key)
+                            level.append((key, Overlay(mods, tunings)))
+                levels.append(level)
+            _overlay_levels = levels
+        return _overlay_levels
+
+
+class ExactIndex:
+    """Roll decomposition and roll-sum tables for one PieceCatalog.
+
+    Tables come from the prebuilt exact_index artifact when it matches this
+    catalog's rolls, and are enumerated in memory on first use otherwise.
+    """
+
+    def __init__(self, catalog, use_artifact=True):
+        self.supported = True
+        self.rolls = {}  # roll key -> base stat vector (before mod and tuning)
+        self.pieces = {}  # (roll key, mod idx, (tuned idx, donor idx) | None) -> representative
+        self.tunable = False
+        rep_of = {v: rep for rep, variants in catalog.equivalents.items() for v in variants}
+        stat_idx = {s: i for i, s in enumerate(STAT_NAMES)}
+
+        kinds = {}
+        for p in catalog.piece_types:
+            vec = list(catalog.piece_stats[p])
+            mod = stat_idx[p.mod_target]
+            vec[mod] -= STANDARD_MOD_VAL
+            tuning = None
+            if p.tuning_mode == "tuned":
+                tuning = (stat_idx[p.tuned_stat], stat_idx[p.siphon_from])
+                vec[tuning[0]] -= TUNING_VAL
+                vec[tuning[1]] += TUNING_VAL
+                self.tunable = True
+            roll = (p.arch, p.tertiary, p.tuning_mode == "balanced")
+            if self.rolls.setdefault(roll, tuple(vec)) != tuple(vec):
+                self.supported = False  # same roll with two bases: not a roll + overlay catalog
+            if is_exotic_piece(p):
+                kinds[roll] = "exotic"
+            else:
+                kinds[roll] = "balanced" if p.tuning_mode == "balanced" else "flat"
+            self.pieces[(roll, mod, tuning)] = rep_of[p]
+
+        self.flat_rolls = sorted(r for r, kind in kinds.items() if kind == "flat")
+        self.balanced_rolls = sorted(r for r, kind in kinds.items() if kind == "balanced")
+        self.exotic_rolls = sorted(r for r, kind in kinds.items() if kind == "exotic")
+        self.max_stat = max(max(v) for v in catalog.piece_stats.values())
+
+        # Flat rolls and every overlay must be multiples of TUNING_VAL so the
+        # stat residues pin down the balanced/exotic part of a build
+        if STANDARD_MOD_VAL % TUNING_VAL or any(v % TUNING_VAL for r in self.flat_rolls for v in self.rolls[r]):
+            self.supported = False
+
+        # Roll lane totals per kind must be uniform so a target's stat sum pins down the mix
+        self.kind_sum = {}
+        for kind, rolls in (("flat", self.flat_rolls), ("balanced", self.balanced_rolls),
+                            ("exotic", self.exotic_rolls)):
+            sums = {sum(self.rolls[r]) for r in rolls}
+            if len(sums) > 1:
+                self.supported = False
+            self.kind_sum[kind] = sums.pop() if sums else None
+
+        self.artifact = None
+        if use_artifact and self.supported:
+            artifact = load_index()
+            if artifact is not None and all(
+                    rolls == stored and all(self.rolls[r] == artifact.vectors[r] for r in rolls)
+                    for rolls, stored in ((self.flat_rolls, artifact.flat_rolls),
+                                          (self.balanced_rolls, artifact.balanced_rolls))):
+                self.artifact = artifact
+
+        self._lock = threading.Lock()
+        self._flat_sums = {}
+        self._balanced_sums = {}
+
+    def flat_sums(self, n):
+        """packed sum -> list of sorted n-roll flat multisets."""
+        if self.artifact is not None:
+            return self.artifact.flat_sums(n)
+        with self._lock:
+            if n not in self._flat_sums:
+                self._flat_sums[n] = build_flat_sums(self.flat_rolls, self.rolls, n)
+            return self._flat_sums[n]
+
+    def balanced_sums(self, n):
+        """packed residue (mod TUNING_VAL) -> list of (n-roll balanced multiset, packed sum)."""
+        if self.artifact is not None:
+            return self.artifact.balanced_sums(n)
+        with self._lock:
+            if n not in self._balanced_sums:
+                self._balanced_sums[n] = build_balanced_sums(self.balanced_rolls, self.rolls, n, TUNING_VAL)
+            return self._balanced_sums[n]
+
+    def realize(self, flat, balanced, exotic, overlay):
+        """Turn rolls plus an overlay into a representative solution, or None if a piece is missing.
+
+        Identical rolls are kept adjacent and handed identical tunings and mods
+        where possible, so the build needs as few distinct piece types as it can.
+        """
+        tunings = sorted(overlay.tunings)
+        slots = [(roll, tunings[i] if i < len(tunings) else None) for i, roll in enumerate(flat)]
+        slots += [(roll, None) for roll in balanced]
+        if exotic is not None:
+            slots.append((exotic, None))
+        slots.sort(key=lambda slot: (slot[0], slot[1] or ()))
+
+        sol = {}
+        for (roll, tuning), mod in zip(slots, sorted(overlay.mods)):
+            rep = self.pieces.get((roll, mod, tuning))
+            if rep is None:
+                return None
+            sol[rep] = sol.get(rep, 0) + 1
+        return normalize_solution(sol)
+
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+def get_exact_index(catalog):
+    """Shared ExactIndex for a memoized catalog; ad-hoc catalogs get a private one."""
+    if catalog.key is None:
+        return ExactIndex(catalog)
+    with _index_lock:
+        index = _indexes.get(catalog.key)
+        if index is None:
+            index = _indexes[catalog.key] = ExactIndex(catalog)
+        return index
+
+
+def solve_exact(desired_totals, catalog, max_solutions=10, require_exotic=False, minimum_constraints=None,
+                deadline=None):
+    """Find exact builds by table lookups, lowest difficulty_score first.
+
+    Returns (solutions, exhausted), or None when the query is outside what the
+    engine models (e.g. several exotics allowed). exhausted is True when every
+    exact build was considered, so CBC has nothing more to find; otherwise only
+    builds with up to MAX_TUNED_SLOTS tuned pieces (fewer under a tight lookup
+    budget) were searched. An expired deadline stops the search between
+    tuned-slot levels with what has been found so far.
+    """
+    index = get_exact_index(catalog)
+    if not index.supported:
+        return None
+    if index.exotic_rolls and not require_exotic:
+        return None  # any number of exotics may be used; leave that to CBC
+
+    totals = [int(v) for v in desired_totals]
+    if any(v < 0 or v > PIECES * index.max_stat for v in totals):
+        return [], True
+    if minimum_constraints:
+        for si, s in enumerate(STAT_NAMES):
+            min_value = minimum_constraints.get(s)
+            if min_value is not None and totals[si] < min_value:
+                return [], True
+    if require_exotic and not index.exotic_rolls:
+        return [], True
+
+    exotic_count = 1 if require_exotic else 0
+    exotic_choices = index.exotic_rolls if require_exotic else [None]
+    target_sum = sum(totals)
+    levels = overlay_levels()
+
+    found = {}
+    exhausted = True
+    for balanced_count in range(PIECES - exotic_count + 1):
+        flat_count = PIECES - exotic_count - balanced_count
+        roll_sum = (flat_count * (index.kind_sum["flat"] or 0)
+                    + balanced_count * (index.kind_sum["balanced"] or 0)
+                    + exotic_count * (index.kind_sum["exotic"] or 0))
+        if roll_sum + PIECES * STANDARD_MOD_VAL != target_sum:
+            continue
+        if flat_count and not index.flat_rolls or balanced_count and not index.balanced_rolls:
+            continue
+
+        # Balanced/exotic rolls are the only ones off the TUNING_VAL grid, so the
+        # target's residues select them directly
+        specials = []
+        for exotic in exotic_choices:
+            rest = [totals[i] - (index.rolls[exotic][i] if exotic else 0) for i in range(len(totals))]
+            if balanced_count:
+                residue = pack([v % TUNING_VAL for v in rest])
+                for combo, combo_key in index.balanced_sums(balanced_count).get(residue, ()):
+                    specials.append((exotic, combo, pack(rest) - combo_key))
+            elif all(v % TUNING_VAL == 0 for v in rest):
+                specials.append((exotic, (), pack(rest)))
+        if not specials:
+            continue
+
+        max_tuned = min(MAX_TUNED_SLOTS, flat_count) if index.tunable else 0
+        probes = 0
+        depth = 0
+        for k in range(max_tuned + 1):
+            probes += len(levels[k]) * len(specials)
+            if k and probes > LOOKUP_BUDGET:
+                break
+            depth = k
+        if index.tunable and depth < flat_count:
+            exhausted = False
+
+        flat_table = index.flat_sums(flat_count)
+        for k in range(depth + 1):
+            if deadline is not None and deadline.expired():
+                deadline.cut_short()
+                exhausted = False
+                break
+            for exotic, combo, rest_key in specials:
+                for offset, overlay in levels[k]:
+                    for flat in flat_table.get(rest_key - offset, ()):
+                        sol = index.realize(flat, combo, exotic, overlay)
+                        if sol is None:
+                            exhausted = False
+                            continue
+                        found.setdefault(frozenset(sol.items()), sol)
+            # Builds without tuned pieces score at most 50, tuned ones at least 70
+            if k == 0 and len(found) >= max_solutions:
+                break
+
+    solutions = sorted(found.values(), key=lambda sol: (
+        difficulty_score(sol), sum(c for p, c in sol.items() if p.tuning_mode == "tuned")))
+    return solutions[:max_solutions], exhausted
@@ -1,5 +1,4 @@
 from http.server import BaseHTTPRequestHandler
-import json
 import sys
 import os
 
@@ -7,27 +6,20 @@ import os
 sys.path.append(os.path.dirname(__file__))
 
 from main import CLASS_ITEM_ROLLS
+from http_response import StaticBody, send_static
+
+# Static for the life of a deployment: serialized, compressed and hashed once per cold start
+EXOTIC_PERKS = StaticBody({
+    "available_combinations": [list(perks) for perks in CLASS_ITEM_ROLLS],
+    # JSON keys must be strings: "Perk A + Perk B" -> [primary, secondary, tertiary]
+    "class_item_rolls": {" + ".join(perks): list(stats) for perks, stats in CLASS_ITEM_ROLLS.items()},
+    "description": "Available perk combinations for exotic class items"
+})
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
-            # Set CORS headers
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            self.end_headers()
-            
-            response = {
-                "available_combinations": list(CLASS_ITEM_ROLLS.keys()),
-                "class_item_rolls": CLASS_ITEM_ROLLS,
-                "description": "Available perk combinations for exotic class items"
-            }
-            
-            # Send response
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-            
+            send_static(self, EXOTIC_PERKS)
         except Exception as e:
             self.send_error(500, f"Failed to get exotic perks: {str(e)}")
     
@@ -36,5 +28,5 @@ class handler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
         self.end_headers()
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Response bodies for the HTTP handlers: gzip negotiation, ETags and Cache-Control.
+
+A handler hands send_body() the serialized body and its validator; a GET
+whose If-None-Match already names that ETag gets 304 Not Modified and no
+body, and clients that accept gzip get the body compressed. Errors
+go out as JSON too (send_json_error), since the frontend parses every
+response body.
+"""
+
+import gzip
+import hashlib
+import json
+
+# Bodies smaller than this go out uncompressed; gzip's framing would eat the saving
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+# Static documents only change with a deploy; revalidation after that is a 304
+STATIC_CACHE_CONTROL = 'public, max-age=3600, stale-while-revalidate=86400'
+# Solver results: clients may keep them but must revalidate (cheap, see send_body)
+RESULT_CACHE_CONTROL = 'private, no-cache'
+
+
+def make_etag(data, weak=False):
+    """Validator for a bytes or str payload. Weak ones only promise the same meaning, not the same bytes."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+    return 'W/' + etag if weak else etag
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value names etag (weak comparison, as RFC 9110 asks for)."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    bare = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows gzip (q=0 opts out)."""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', 'x-gzip', '*'):
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+class StaticBody:
+    """A JSON document serialized, compressed and hashed once, then served as is."""
+
+    def __init__(self, document):
+        self.body = json.dumps(document).encode('utf-8')
+        self.gzipped = gzip.compress(self.body, GZIP_LEVEL) if len(self.body) >= GZIP_MIN_BYTES else None
+        self.etag = make_etag(self.body)
+
+
+def send_body(request_handler, body, etag=None, cache_control=None, methods='GET, OPTIONS',
+              extra_headers=(), gzipped=None):
+    """Write a 200 JSON response (or 304 to a GET whose client already holds etag); returns the status sent.
+
+    304 only answers GET and HEAD (RFC 9110 13.1.2), so other methods always
+    get the body; their ETag still tells a client whether the result changed.
+    gzipped is a precompressed copy of body, if the caller has one.
+    """
+    h = request_handler
+    if (etag and h.command in ('GET', 'HEAD')
+            and etag_matches(h.headers.get('If-None-Match'), etag)):
+        h.send_response(304)
+        h.send_header('ETag', etag)
+        if cache_control:
+            h.send_header('Cache-Control', cache_control)
+        h.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in extra_headers:
+            h.send_header(name, value)
+        h.end_headers()
+        return 304
+    if accepts_gzip(h.headers.get('Accept-Encoding')) and len(body) >= GZIP_MIN_BYTES:
+        body = gzipped or gzip.compress(body, GZIP_LEVEL)
+        encoding = 'gzip'
+    else:
+        encoding = None
+    h.send_response(200)
+    h.send_header('Content-Type', 'application/json')
+    h.send_header('Content-Length', str(len(body)))
+    if encoding:
+        h.send_header('Content-Encoding', encoding)
+    h.send_header('Vary', 'Accept-Encoding')
+    if etag:
+        h.send_header('ETag', etag)
+    if cache_control:
+        h.send_header('Cache-Control', cache_control)
+    h.send_header('Access-Control-Allow-Origin', '*')
+    h.send_header('Access-Control-Allow-Methods', methods)
+    h.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+    h.send_header('Access-Control-Expose-Headers', 'ETag')
+    for name, value in extra_headers:
+        h.send_header(name, value)
+    h.end_headers()
+    h.wfile.write(body)
+    return 200
+
+
+def send_json_error(request_handler, status, message, extra_headers=(), **fields):
+    """Write an error as {"error": message, **fields}, in place of BaseHTTPRequestHandler's HTML send_error()."""
+    h = request_handler
+    timer = getattr(h, 'timer', None)
+    if timer is not None:
+        timer.note(status=status)
+    body = json.dumps({"error": message, **fields}).encode('utf-8')
+    h.send_response(status)
+    h.send_header('Content-Type', 'application/json')
+    h.send_header('Content-Length', str(len(body)))
+    h.send_header('Access-Control-Allow-Origin', '*')
+    for name, value in extra_headers:
+        h.send_header(name, value)
+    h.end_headers()
+    h.wfile.write(body)
+
+
+def send_static(request_handler, static_body):
+    """Serve a StaticBody from a GET endpoint."""
+    send_body(request_handler, static_body.body, static_body.etag, STATIC_CACHE_CONTROL,
+              gzipped=static_body.gzipped)
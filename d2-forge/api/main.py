@@ -1,12 +1,40 @@
 from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from heapq import heappush, heappushpop
+from itertools import combinations
+from types import MappingProxyType
+import importlib.util
+import multiprocessing
+import threading
 import time
 
-try:
-    import pulp
+# pulp is imported on the first CBC solve (see _load_pulp) so that requests
+# answered by exact lookups never pay for it
+HAS_PULP = importlib.util.find_spec("pulp") is not None
+pulp = None
+
+
+def _load_pulp():
+    global pulp
+    if pulp is None:
+        import pulp as pulp_module
+        pulp = pulp_module
+    return pulp
 
-    HAS_PULP = True
+# numpy is optional: with it, catalogs carry their stats as an array and
+# per-catalog scans are vectorized; without it the same scans run in Python
+try:
+    import numpy as np
+    HAS_NUMPY = True
 except ImportError:
-    HAS_PULP = False
+    np = None
+    HAS_NUMPY = False
+
+# Bump with any change that alters which builds the solver returns, or their order;
+# precomputed responses (response_pack.py) from another version are then ignored
+SOLVER_VERSION = 1
 
 # ----------------------------
 # Problem constants
@@ -54,6 +82,61 @@ PieceType = namedtuple(
 from exotic_class_items import CLASS_ITEM_ROLLS
 
 
+# ----------------------------
+# Piece table (interned ids and flags)
+# ----------------------------
+
+# Generated pieces are interned once per process: each gets a small integer
+# id, and the decode table hands back one shared PieceType per id. Flags
+# are worked out at interning, so exotic/tuned/balanced checks in the
+# solver are a list lookup rather than string comparisons.
+PIECE_EXOTIC = 1
+PIECE_TUNED = 2
+PIECE_BALANCED = 4
+
+_piece_ids = {}  # PieceType -> id
+_piece_table = []  # id -> PieceType
+_piece_flag_table = []  # id -> PIECE_* bits
+_piece_lock = threading.Lock()
+
+
+def _flags_of(p):
+    flags = PIECE_EXOTIC if str(p.arch).lower().startswith("exotic ") else 0
+    if p.tuning_mode == "tuned":
+        flags |= PIECE_TUNED
+    elif p.tuning_mode == "balanced":
+        flags |= PIECE_BALANCED
+    return flags
+
+
+def piece_id(p):
+    """Integer id of p, interning it on first sight."""
+    pid = _piece_ids.get(p)
+    if pid is None:
+        with _piece_lock:
+            pid = _piece_ids.get(p)
+            if pid is None:
+                pid = len(_piece_table)
+                _piece_table.append(p)
+                _piece_flag_table.append(_flags_of(p))
+                _piece_ids[p] = pid
+    return pid
+
+
+def piece_from_id(pid):
+    return _piece_table[pid]
+
+
+def piece_flags(p):
+    """PIECE_* bits for p. Pieces that were never interned (e.g. read back from a cache) are not added."""
+    pid = _piece_ids.get(p)
+    return _flags_of(p) if pid is None else _piece_flag_table[pid]
+
+
+def is_exotic_piece(p):
+    return bool(piece_flags(p) & PIECE_EXOTIC)
+
+
 # ----------------------------
 # Piece generation (now supports Balanced Tuning correctly)
 # ----------------------------
@@ -162,6 +245,8 @@ def generate_piece_types(allow_tuned=True, *, use_exotic=False, use_class_item_e
                         piece_types.append(p_none)
                         piece_stats[p_none] = tuple(mod_applied)
 
+    # Hand out the interned instances so every catalog shares one object per piece
+    piece_types = [piece_from_id(piece_id(p)) for p in piece_types]
     return piece_types, piece_stats
 
 
@@ -169,6 +254,90 @@ def generate_piece_types(allow_tuned=True, *, use_exotic=False, use_class_item_e
 # Helpers
 # ----------------------------
 
+# Wall-clock cost of one CBC call outside its own time limit (writing the model, process start, reading back)
+CBC_OVERHEAD_SECONDS = 0.5
+# Below this, CBC rarely gets past the LP relaxation, so the solve is skipped and the result marked partial
+MIN_CBC_SECONDS = 0.5
+
+
+class Deadline:
+    """A hard wall-clock budget shared by every stage of one request.
+
+    Stages check it before starting more work and size solver time limits
+    from what is left. Whoever stops early because of it calls cut_short(),
+    so the caller can flag the result as partial.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self.partial = False
+
+    def remaining(self):
+        """Seconds left, or None for an unlimited budget."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def solver_time_limit(self):
+        """CBC timeLimit that still finishes in time, None if unlimited, or 0 when another solve won't fit."""
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        return max(0.0, remaining - CBC_OVERHEAD_SECONDS)
+
+    def cut_short(self):
+        self.partial = True
+
+
+class SolveStats:
+    """Where one solve_with_milp_multiple call spent its time (for benchmarks and timing headers).
+
+    Stages nest: "phase1" (exact matches) and "phase2" (approximations)
+    include the lookups, model builds and CBC calls made during them. Only
+    work done in this process is recorded; with workers > 1 the CBC phases
+    run in worker processes and show up as one "partitions" stage.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(float)  # stage name -> seconds, in the order first entered
+        self.cbc_calls = []  # seconds per CBC run (model write, solve and read-back)
+        self.iterations = 0  # CBC solves in the enumeration loops
+        self.duplicates = 0  # builds found again after they were accepted
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def merge(self, other):
+        """Add in the stats of a solve run elsewhere (e.g. in a solver pool worker)."""
+        for stage, seconds in other.stages.items():
+            self.stages[stage] += seconds
+        self.cbc_calls.extend(other.cbc_calls)
+        self.iterations += other.iterations
+        self.duplicates += other.duplicates
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] += time.perf_counter() - start
+
+    @contextmanager
+    def cbc_call(self):
+        """Time one CBC run; it also counts towards the "cbc" stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages["cbc"] += seconds
+            self.cbc_calls.append(seconds)
+
+
 def normalize_solution(sol):
     # Keep pieces distinct by all fields, but compact same descriptors
     norm = {}
@@ -188,8 +357,53 @@ def difficulty_score(sol):
     return distinct_types * 10 + tuning_count * 60  # 60 points per tuned piece vs 10 per distinct type
 
 
-def identical_piece_check(desired_totals, piece_types, piece_stats):
-    """Return a solution if exactly 5 of a single piece type matches totals."""
+def farming_rank(p):
+    """Sort key for how hard a piece type is to farm (lower is easier)."""
+    return (p.tuning_mode == "tuned", p.tuning_mode == "balanced")
+
+
+def collapse_equivalent_pieces(piece_types, piece_stats):
+    """Group piece types that share an identical stat vector.
+
+    Many tuned variants end up equal to another variant (e.g. +5/-5 pairs that
+    cancel against a different mod_target), and each would otherwise become its
+    own MILP variable. Exotic and non-exotic pieces are never merged so
+    require_exotic keeps counting correctly.
+
+    Returns (rep_types, rep_stats, equivalents) where rep_types holds the
+    easiest-to-farm representative of each class (in catalog order) and
+    equivalents maps every representative to all of its variants, representative first.
+    """
+    classes = {}
+    for p in piece_types:
+        key = (piece_stats[p], is_exotic_piece(p))
+        classes.setdefault(key, []).append(p)
+
+    rep_types = []
+    rep_stats = {}
+    equivalents = {}
+    for members in classes.values():
+        members.sort(key=farming_rank)  # stable: catalog order breaks ties
+        rep = members[0]
+        rep_types.append(rep)
+        rep_stats[rep] = piece_stats[rep]
+        equivalents[rep] = tuple(members)
+    return rep_types, rep_stats, equivalents
+
+
+def expand_equivalents(sol, equivalents):
+    """Map each representative in a solved build to every variant it stands for."""
+    return {p: equivalents.get(p, (p,)) for p in sol}
+
+
+def identical_piece_check(desired_totals, piece_types, piece_stats, catalog=None):
+    """Return a solution if exactly 5 of a single piece type matches totals.
+
+    Pass the catalog the pieces came from to scan its stat array instead.
+    """
+    if catalog is not None and catalog.stat_array is not None:
+        matches = np.flatnonzero((catalog.stat_array * 5 == np.asarray(desired_totals)).all(axis=1))
+        return {catalog.rep_types[matches[0]]: 5} if len(matches) else None
     for p in piece_types:
         stats = piece_stats[p]
         if all(stats[i] * 5 == desired_totals[i] for i in range(6)):
@@ -197,128 +411,950 @@ def identical_piece_check(desired_totals, piece_types, piece_stats):
     return None
 
 
+# ----------------------------
+# Piece catalog (memoized per configuration)
+# ----------------------------
+
+# Everything the solver needs for one generate_piece_types configuration.
+# All fields are immutable and shared between requests: never mutate them.
+PieceCatalog = namedtuple(
+    "PieceCatalog",
+    [
+        "key",  # catalog_key() tuple, or None for an ad-hoc piece list
+        "piece_types",  # tuple of every generated PieceType
+        "piece_stats",  # read-only PieceType -> stat tuple
+        "rep_types",  # tuple of one representative per distinct stat vector
+        "rep_stats",  # read-only representative -> stat tuple
+        "equivalents",  # read-only representative -> tuple of variants
+        "stat_matrix",  # tuple of stat tuples, aligned with rep_types
+        "exotic_mask",  # tuple of bools, aligned with rep_types
+        "tuned_mask",  # tuple of bools, aligned with rep_types
+        "stat_array",  # read-only (len(rep_types), 6) int array of stat_matrix, or None without numpy
+        "exotic_index",  # positions in rep_types of the exotic representatives
+        "tuned_index",  # positions in rep_types of the tuned representatives
+    ],
+)
+
+
+def catalog_key(allow_tuned=True, *, use_exotic=False, use_class_item_exotic=False, exotic_perks=None):
+    """Reduce catalog options to the ones that actually change the generated pieces."""
+    use_class_item_exotic = bool(use_exotic and use_class_item_exotic)
+    exotic_perks = tuple(exotic_perks) if use_class_item_exotic and exotic_perks else None
+    if exotic_perks and exotic_perks not in CLASS_ITEM_ROLLS and exotic_perks[::-1] in CLASS_ITEM_ROLLS:
+        exotic_perks = exotic_perks[::-1]  # each perk pair is listed in one order only
+    return bool(allow_tuned), bool(use_exotic), use_class_item_exotic, exotic_perks
+
+
+def _catalog_from_pieces(piece_types, piece_stats, key=None):
+    """Build an uncached PieceCatalog view over an ad-hoc piece list."""
+    rep_types, rep_stats, equivalents = collapse_equivalent_pieces(piece_types, piece_stats)
+    stat_matrix = tuple(rep_stats[p] for p in rep_types)
+    flags = [piece_flags(p) for p in rep_types]
+    exotic_mask = tuple(bool(f & PIECE_EXOTIC) for f in flags)
+    tuned_mask = tuple(bool(f & PIECE_TUNED) for f in flags)
+    stat_array = None
+    if HAS_NUMPY:
+        stat_array = np.array(stat_matrix, dtype=np.int64).reshape(len(stat_matrix), len(STAT_NAMES))
+        stat_array.setflags(write=False)
+    return PieceCatalog(
+        key=key,
+        piece_types=tuple(piece_types),
+        piece_stats=MappingProxyType(dict(piece_stats)),
+        rep_types=tuple(rep_types),
+        rep_stats=MappingProxyType(rep_stats),
+        equivalents=MappingProxyType(equivalents),
+        stat_matrix=stat_matrix,
+        exotic_mask=exotic_mask,
+        tuned_mask=tuned_mask,
+        stat_array=stat_array,
+        exotic_index=tuple(i for i, is_exotic in enumerate(exotic_mask) if is_exotic),
+        tuned_index=tuple(i for i, is_tuned in enumerate(tuned_mask) if is_tuned),
+    )
+
+
+def get_piece_catalog(allow_tuned=True, *, use_exotic=False, use_class_item_exotic=False, exotic_perks=None):
+    """Return the shared PieceCatalog for this configuration, building it on first use."""
+    return _build_catalog(*catalog_key(allow_tuned, use_exotic=use_exotic,
+                                       use_class_item_exotic=use_class_item_exotic,
+                                       exotic_perks=exotic_perks))
+
+
+@lru_cache(maxsize=None)
+def _build_catalog(allow_tuned, use_exotic, use_class_item_exotic, exotic_perks):
+    # The key space is small (allow_tuned x use_exotic x CLASS_ITEM_ROLLS), so no eviction
+    piece_types, piece_stats = generate_piece_types(
+        allow_tuned=allow_tuned,
+        use_exotic=use_exotic,
+        use_class_item_exotic=use_class_item_exotic,
+        exotic_perks=exotic_perks,
+    )
+    return _catalog_from_pieces(piece_types, piece_stats,
+                                key=(allow_tuned, use_exotic, use_class_item_exotic, exotic_perks))
+
+
+# ----------------------------
+# Feasibility pre-screen
+# ----------------------------
+
+class InfeasibleRequest(ValueError):
+    """The request can't be satisfied by any build, not even approximately."""
+
+
+_screen_lock = threading.Lock()
+_screens = {}
+
+
+def _slot_groups(catalog, require_exotic):
+    """[(stat vectors, slot count)] describing how the 5 pieces may be drawn from the catalog."""
+    if require_exotic:
+        exotic = [v for v, is_exotic in zip(catalog.stat_matrix, catalog.exotic_mask) if is_exotic]
+        regular = [v for v, is_exotic in zip(catalog.stat_matrix, catalog.exotic_mask) if not is_exotic]
+        if not exotic or not regular:
+            return None
+        return [(exotic, 1), (regular, 4)]
+    return [(catalog.stat_matrix, 5)]
+
+
+def _reachable_residues(groups):
+    """Every per-stat residue vector (mod TUNING_VAL) a 5-piece build can have."""
+    reachable = {(0,) * len(STAT_NAMES)}
+    for vectors, slots in groups:
+        steps = {tuple(v % TUNING_VAL for v in vec) for vec in vectors}
+        for _ in range(slots):
+            reachable = {tuple((a + b) % TUNING_VAL for a, b in zip(r, step)) for r in reachable for step in steps}
+    return frozenset(reachable)
+
+
+def _screen_tables(catalog, require_exotic):
+    """Per-configuration bounds: (slot groups, per-stat (min, max), reachable residues), or None."""
+    def build():
+        groups = _slot_groups(catalog, require_exotic)
+        if groups is None:
+            return None
+        bounds = [(sum(slots * min(v[i] for v in vectors) for vectors, slots in groups),
+                   sum(slots * max(v[i] for v in vectors) for vectors, slots in groups))
+                  for i in range(len(STAT_NAMES))]
+        return groups, bounds, _reachable_residues(groups)
+
+    if catalog.key is None:
+        return build()
+    with _screen_lock:
+        key = (catalog.key, bool(require_exotic))
+        if key not in _screens:
+            _screens[key] = build()
+        return _screens[key]
+
+
+def exact_candidates(desired_totals, catalog):
+    """Positions in rep_types of the representatives that can be part of an exact match.
+
+    A piece fits only if four more pieces, each within the catalog's per-stat
+    range, can make up the rest of every stat. Exact-match models leave the
+    others out.
+    """
+    if catalog.stat_array is not None:
+        stats = catalog.stat_array
+        target = np.asarray(desired_totals)
+        fits = ((stats + 4 * stats.min(axis=0) <= target) & (stats + 4 * stats.max(axis=0) >= target)).all(axis=1)
+        return np.flatnonzero(fits).tolist()
+    if not catalog.stat_matrix:
+        return []
+    columns = list(zip(*catalog.stat_matrix))
+    ranges = [(4 * min(column), 4 * max(column)) for column in columns]
+    return [i for i, stats in enumerate(catalog.stat_matrix)
+            if all(v + lo <= t <= v + hi for v, (lo, hi), t in zip(stats, ranges, desired_totals))]
+
+
+def stat_bounds(catalog, require_exotic=False):
+    """Per-stat (lowest, highest) total any 5-piece build can have, or None if no build is possible."""
+    tables = _screen_tables(catalog, require_exotic)
+    return None if tables is None else tables[1]
+
+
+def prescreen(desired_totals, catalog, require_exotic=False, minimum_constraints=None):
+    """Cheap necessary conditions checked before any solver runs.
+
+    Returns None when an exact match may exist, or a short reason why it
+    can't (the request then goes straight to the approximate phase). Raises
+    InfeasibleRequest when no build at all can be returned: no exotic to
+    satisfy require_exotic, or minimum_constraints that no 5 pieces reach,
+    alone or in combination.
+    """
+    tables = _screen_tables(catalog, require_exotic)
+    if tables is None:
+        raise InfeasibleRequest("No exotic pieces are available for this configuration")
+    groups, bounds, residues = tables
+
+    if minimum_constraints:
+        mins = {s: v for s, v in minimum_constraints.items() if s in STAT_IDX and v is not None}
+        names = sorted(mins, key=STAT_IDX.get)
+        # Minimums on several stats compete for the same pieces; check every combination
+        for size in range(1, len(names) + 1):
+            for subset in combinations(names, size):
+                idx = [STAT_IDX[s] for s in subset]
+                best = sum(slots * max(sum(v[i] for i in idx) for v in vectors) for vectors, slots in groups)
+                need = sum(mins[s] for s in subset)
+                if need > best:
+                    raise InfeasibleRequest(
+                        f"Minimum constraints can't be met: {' + '.join(subset)} must total at least "
+                        f"{need}, but no 5 pieces give more than {best}")
+
+    totals = [int(v) for v in desired_totals]
+    for i, s in enumerate(STAT_NAMES):
+        lo, hi = bounds[i]
+        if not lo <= totals[i] <= hi:
+            return f"{s} {totals[i]} is outside the reachable range {lo}-{hi}"
+        min_value = minimum_constraints.get(s) if minimum_constraints else None
+        if min_value is not None and totals[i] < min_value:
+            return f"{s} {totals[i]} is below its minimum of {min_value}"
+    total_lo = sum(slots * min(sum(v) for v in vectors) for vectors, slots in groups)
+    total_hi = sum(slots * max(sum(v) for v in vectors) for vectors, slots in groups)
+    if not total_lo <= sum(totals) <= total_hi:
+        return f"stat total {sum(totals)} is outside the reachable range {total_lo}-{total_hi}"
+    if tuple(v % TUNING_VAL for v in totals) not in residues:
+        return f"no combination of pieces reaches these totals modulo {TUNING_VAL}"
+    return None
+
+
 # ----------------------------
 # MILP solver (exact + approximate)
 # ----------------------------
 
-def solve_with_milp_multiple(desired_totals, piece_types, piece_stats, max_solutions=10, allow_tuned=True,
-                             require_exotic=False, total_timeout=120, minimum_constraints=None):
-    if not HAS_PULP:
-        raise RuntimeError("pulp not installed; can't run MILP")
+# Phase 2 cost per stat point: missing stats hurt builds much more than excess ones
+EXCESS_WEIGHT = 0.2
+SHORTFALL_WEIGHT = 5.0
 
-    start_time = time.time()
-    
-    solutions = []
-    deviations = []
 
-    # Fast-path identical only when no exotic is required
-    if not require_exotic:
-        ident = identical_piece_check(desired_totals, piece_types, piece_stats)
-        if ident:
-            solutions.append(ident)
-            deviations.append(0.0)
+def build_deviation(sol, desired_totals, catalog, require_exotic=False, minimum_constraints=None):
+    """Phase 2 deviation of a known build, or None if it isn't a valid build for this problem.
+
+    Vets builds that come from elsewhere (e.g. a cached nearby request) before
+    they are handed to CBC.
+    """
+    if sum(sol.values()) != 5 or any(p not in catalog.rep_stats for p in sol):
+        return None
+    if require_exotic and sum(c for p, c in sol.items() if is_exotic_piece(p)) != 1:
+        return None
+    deviation = 0.0
+    for si, s in enumerate(STAT_NAMES):
+        total = sum(c * catalog.rep_stats[p][si] for p, c in sol.items())
+        min_value = minimum_constraints.get(s) if minimum_constraints else None
+        if min_value is not None and total < min_value:
+            return None
+        if total > desired_totals[si]:
+            deviation += EXCESS_WEIGHT * (total - desired_totals[si])
+        else:
+            deviation += SHORTFALL_WEIGHT * (desired_totals[si] - total)
+    return deviation
 
-    exclusions = []
 
-    def solve_problem(allow_deviation=False, use_timeout=False):
-        if use_timeout:
-            # Calculate remaining time for this solver call
-            elapsed = time.time() - start_time
-            remaining_time = max(10, total_timeout - elapsed)  # At least 10 seconds per call
+class MilpSession:
+    """A CBC model built once per solver phase and re-solved as exclusion cuts are added.
+
+    Only the cuts change between iterations of the enumeration loop, so the
+    variables, stat constraints and objective are constructed a single time
+    instead of once per solve.
+
+    With rank_by_difficulty the objective is difficulty_score itself (through
+    one binary "type used" indicator per representative), so successive solves
+    walk the solution pool best-first. It is much slower for CBC than the
+    default fewest-tuned-pieces objective.
+
+    tuned_pieces fixes how many tuned pieces the build uses, which splits the
+    search space into disjoint slices for parallel enumeration.
+    """
+
+    def __init__(self, desired_totals, catalog, allow_deviation=False, require_exotic=False,
+                 minimum_constraints=None, rank_by_difficulty=False, tuned_pieces=None):
+        if not HAS_PULP:
+            raise RuntimeError("pulp not installed; can't run MILP")
+        _load_pulp()
+        self.catalog = catalog
+        self.allow_deviation = allow_deviation
+        self.desired_totals = desired_totals
+        self.require_exotic = require_exotic
+        self.minimum_constraints = minimum_constraints
+        self.feasible = True
+        # One variable per representative that can appear in an answer (rep_types positions)
+        cols = self._cols = (list(range(len(catalog.rep_types))) if allow_deviation
+                             else exact_candidates(desired_totals, catalog))
+        self._index = {catalog.rep_types[i]: k for k, i in enumerate(cols)}
+        self._cuts = 0
+        self._warm = False
+        self._cutoff = None
+        self.used = None
+        self.stopped_early = False  # last solve hit its time limit before proving its answer
+
+        prob = self.prob = pulp.LpProblem("DestinyArmor3", pulp.LpMinimize)
+        x = self.x = [pulp.LpVariable(f"x_{i}", lowBound=0, upBound=5, cat="Integer") for i in cols]
+        if not cols:
+            self.feasible = False
+            return
+        # Constraints are built column-wise: one (variable, coefficient) list per stat
+        if catalog.stat_array is not None:
+            columns = catalog.stat_array[cols].T.tolist()
         else:
-            remaining_time = None  # No timeout for exact solutions
-        prob = pulp.LpProblem("DestinyArmor3", pulp.LpMinimize)
-        x = {p: pulp.LpVariable(f"x_{i}", lowBound=0, upBound=5, cat="Integer")
-             for i, p in enumerate(piece_types)}
+            columns = [[catalog.stat_matrix[i][si] for i in cols] for si in range(len(STAT_NAMES))]
+        exotic = set(catalog.exotic_index)
+        tuned = set(catalog.tuned_index)
 
         if allow_deviation:
-            dev_pos = {s: pulp.LpVariable(f"dev_pos_{s}", lowBound=0) for s in STAT_NAMES}
-            dev_neg = {s: pulp.LpVariable(f"dev_neg_{s}", lowBound=0) for s in STAT_NAMES}
+            self.dev_pos = {s: pulp.LpVariable(f"dev_pos_{s}", lowBound=0) for s in STAT_NAMES}
+            self.dev_neg = {s: pulp.LpVariable(f"dev_neg_{s}", lowBound=0) for s in STAT_NAMES}
 
         # exactly 5 pieces
-        prob += pulp.lpSum(x[p] for p in piece_types) == 5
+        prob += pulp.LpAffineExpression((v, 1) for v in x) == 5
 
         # require exactly one exotic if requested
         if require_exotic:
-            exotic_vars = [x[p] for p in piece_types if str(p.arch).lower().startswith("exotic ")]
+            exotic_vars = [(v, 1) for v, i in zip(x, cols) if i in exotic]
             if exotic_vars:
-                prob += pulp.lpSum(exotic_vars) == 1
+                prob += pulp.LpAffineExpression(exotic_vars) == 1
             else:
-                return None, None
+                self.feasible = False
+
+        # restrict to one slice of the search space (see PartitionTask)
+        if tuned_pieces is not None:
+            prob += pulp.LpAffineExpression((v, 1) for v, i in zip(x, cols) if i in tuned) == tuned_pieces
 
-        # stat matching
+        # stat matching, plus minimum constraints (must be satisfied even with deviation)
         for si, s in enumerate(STAT_NAMES):
-            total_stat = pulp.lpSum(x[p] * piece_stats[p][si] for p in piece_types)
+            total_stat = pulp.LpAffineExpression((v, c) for v, c in zip(x, columns[si]) if c)
             if allow_deviation:
-                prob += total_stat - desired_totals[si] == dev_pos[s] - dev_neg[s]
+                prob += total_stat - desired_totals[si] == self.dev_pos[s] - self.dev_neg[s]
             else:
                 prob += total_stat == desired_totals[si]
-        
-        # minimum constraints (must be satisfied even with deviation)
-        if minimum_constraints:
-            for si, s in enumerate(STAT_NAMES):
-                min_value = minimum_constraints.get(s)
-                if min_value is not None:
-                    total_stat = pulp.lpSum(x[p] * piece_stats[p][si] for p in piece_types)
-                    prob += total_stat >= min_value
+            min_value = minimum_constraints.get(s) if minimum_constraints else None
+            if min_value is not None:
+                prob += total_stat >= min_value
 
         # objective (prefer easier pieces)
-        ease_bonus = pulp.lpSum(x[p] * (1 if getattr(p, 'tuning_mode', 'none') != "tuned" else 0) for p in piece_types)
+        if rank_by_difficulty:
+            # y[i] = 1 when type i is used; same weights as difficulty_score
+            used = self.used = [pulp.LpVariable(f"y_{i}", cat="Binary") for i in cols]
+            for v, y in zip(x, used):
+                prob += v <= 5 * y
+            difficulty = pulp.LpAffineExpression((y, 70 if i in tuned else 10) for y, i in zip(used, cols))
+        else:
+            ease_bonus = pulp.LpAffineExpression((v, 1) for v, i in zip(x, cols) if i not in tuned)
         if allow_deviation:
             # Weight negative deviations (missing stats) much more heavily than positive (excess stats)
             # Missing stats hurt builds significantly more than having extra stats
-            deviation_cost = pulp.lpSum(0.2 * dev_pos[s] + 5.0 * dev_neg[s] for s in STAT_NAMES)
-            prob += deviation_cost - 0.01 * ease_bonus
+            deviation_cost = pulp.lpSum(
+                EXCESS_WEIGHT * self.dev_pos[s] + SHORTFALL_WEIGHT * self.dev_neg[s] for s in STAT_NAMES)
+            if rank_by_difficulty:
+                # Deviation first; difficulty (at most 350) only breaks ties below one 0.2 step
+                prob += deviation_cost + 0.0005 * difficulty
+            else:
+                prob += deviation_cost - 0.01 * ease_bonus
+        elif rank_by_difficulty:
+            prob += difficulty
         else:
             prob += -1 * ease_bonus
 
-        # exclude prior exact selections
-        for excl in exclusions:
-            prob += pulp.lpSum(x[p] for p in excl) <= 4
-
-        if remaining_time is not None:
-            prob.solve(pulp.PULP_CBC_CMD(msg=True, timeLimit=remaining_time))
+    def exclude(self, sol):
+        """Cut off exactly this selection (types and counts) from every later solve.
+
+        Every build has 5 pieces, so x equals sol iff x[p] >= sol[p] for all p in
+        sol. The cut requires at least one p to fall short, picked by a binary.
+        Other counts over the same types stay feasible.
+        """
+        if any(p not in self._index for p in sol):
+            return  # uses a piece this model left out, so it can't come back anyway
+        self._cuts += 1
+        counts = [(self.x[self._index[p]], c) for p, c in sol.items()]
+        if len(counts) == 1:
+            v, c = counts[0]
+            self.prob += v <= c - 1, f"exclude_{self._cuts}"
+            return
+        short = [pulp.LpVariable(f"z_{self._cuts}_{j}", cat="Binary") for j in range(len(counts))]
+        self.prob += pulp.lpSum(short) >= 1, f"exclude_{self._cuts}"
+        for j, ((v, c), z) in enumerate(zip(counts, short)):
+            self.prob += v <= c - 1 + 5 * (1 - z), f"exclude_{self._cuts}_{j}"
+
+    def warm_start(self, sol):
+        """Hand CBC a known-feasible build as its starting incumbent for the next solve."""
+        reps = self.catalog.rep_types
+        for k, (v, i) in enumerate(zip(self.x, self._cols)):
+            count = sol.get(reps[i], 0)
+            v.setInitialValue(count)
+            if self.used is not None:
+                self.used[k].setInitialValue(1 if count else 0)
+        self._warm = True
+
+    def bound_deviation(self, limit):
+        """Only admit builds that score at most limit (allow_deviation models, where that's deviation + tie-breaks).
+
+        Passed to CBC as its objective cutoff: a constraint row on the
+        objective would slow down every LP it solves.
+        """
+        self._cutoff = limit
+
+    def relaxation_feasible(self):
+        """Solve the LP relaxation only; False proves the model has no integer solution either."""
+        if not self.feasible:
+            return False
+        self.prob.solve(pulp.PULP_CBC_CMD(msg=False, mip=False))
+        return pulp.LpStatus[self.prob.status] != "Infeasible"
+
+    def solve(self, time_limit=None):
+        """Re-solve with the cuts added so far; returns (solution, deviation) or (None, None)."""
+        if not self.feasible:
+            return None, None
+        warm, self._warm = self._warm, False
+        options = [] if self._cutoff is None else [f"cutoff {self._cutoff}"]
+        if time_limit is not None:
+            self.prob.solve(pulp.PULP_CBC_CMD(msg=True, timeLimit=time_limit, warmStart=warm, options=options))
         else:
-            prob.solve(pulp.PULP_CBC_CMD(msg=True))  # No timeout
-        if pulp.LpStatus[prob.status] not in ["Optimal", "Not Solved"]:
+            self.prob.solve(pulp.PULP_CBC_CMD(msg=True, warmStart=warm, options=options))  # No timeout
+        self.stopped_early = time_limit is not None and self.prob.sol_status in (
+            pulp.LpSolutionNoSolutionFound, pulp.LpSolutionIntegerFeasible)
+        # A solve that timed out before finding an integer solution leaves fractional LP values behind
+        if self.prob.sol_status not in (pulp.LpSolutionOptimal, pulp.LpSolutionIntegerFeasible):
             return None, None
 
-        sol = {p: int(round(x[p].value())) for p in piece_types if x[p].value() and x[p].value() > 0.5}
-        dev_total = 0.0
-        if allow_deviation:
-            # Apply same weighting as in objective: negative deviations are much worse than positive
-            dev_total = sum(0.2 * (dev_pos[s].value() or 0) + 5.0 * (dev_neg[s].value() or 0) for s in STAT_NAMES)
-        return normalize_solution(sol), dev_total
+        reps = self.catalog.rep_types
+        sol = {reps[i]: int(round(v.value())) for i, v in zip(self._cols, self.x) if v.value() and v.value() > 0.5}
+        sol = normalize_solution(sol)
+        # Scored from the pieces themselves rather than CBC's deviation variables
+        dev_total = build_deviation(sol, self.desired_totals, self.catalog, require_exotic=self.require_exotic,
+                                    minimum_constraints=self.minimum_constraints)
+        if dev_total is None or (not self.allow_deviation and dev_total != 0):
+            return None, None
+        return sol, dev_total
+
+
+# ----------------------------
+# Local search (fast approximations)
+# ----------------------------
+
+# Cost per point below a minimum constraint while searching: high enough that
+# the search leaves such builds first, finite so it can pass through them
+MINIMUM_PENALTY = 1000.0
+# Trie nodes one piece lookup may expand once it has its answers; only hit when
+# many pieces tie (e.g. targets far beyond any build), where any of them will do
+PIECE_SEARCH_BUDGET = 400
+
+_trie_lock = threading.Lock()
+_tries = {}
+
+
+def _stat_trie(catalog, exotic=None):
+    """(trie, values per stat): representatives as nested {stat value: child} dicts, one level per stat.
+
+    Leaves are rep indices; representatives have distinct stat vectors, so each
+    path leads to exactly one. exotic=None indexes every representative, True
+    or False only the exotic or non-exotic ones.
+    """
+    def build():
+        root = {}
+        values = [set() for _ in STAT_NAMES]
+        for i, (stats, is_exotic) in enumerate(zip(catalog.stat_matrix, catalog.exotic_mask)):
+            if exotic is not None and is_exotic != exotic:
+                continue
+            node = root
+            for v in stats[:-1]:
+                node = node.setdefault(v, {})
+            node[stats[-1]] = i
+            for seen, v in zip(values, stats):
+                seen.add(v)
+        return root, tuple(tuple(sorted(seen)) for seen in values)
+
+    if catalog.key is None:
+        return build()
+    with _trie_lock:
+        key = (catalog.key, exotic)
+        if key not in _tries:
+            _tries[key] = build()
+        return _tries[key]
+
+
+def _stat_cost(total, target, minimum):
+    cost = EXCESS_WEIGHT * (total - target) if total > target else SHORTFALL_WEIGHT * (target - total)
+    if minimum is not None and total < minimum:
+        cost += MINIMUM_PENALTY * (minimum - total)
+    return cost
+
+
+def _best_pieces(trie, stat_costs, count):
+    """The count leaves with the lowest summed stat_costs[i](value), as [(cost, rep index)] best first.
+
+    trie comes from _stat_trie. Children are tried cheapest first, and a branch
+    stops as soon as its cost so far, plus the cheapest possible cost of the
+    stats below it, can't beat the count-th best leaf found (or the search has
+    used up PIECE_SEARCH_BUDGET).
+    """
+    root, values = trie
+    last = len(stat_costs) - 1
+    # floor[level]: lowest possible cost of the stats from level on
+    floor = [0.0] * (last + 2)
+    for level in range(last, -1, -1):
+        floor[level] = floor[level + 1] + min(stat_costs[level](v) for v in values[level])
+    best = []  # heap of (-cost, rep index), worst on top
+    expanded = [0]
+
+    def visit(node, level, cost_so_far):
+        expanded[0] += 1
+        cost_of = stat_costs[level]
+        for cost, child in sorted(((cost_so_far + cost_of(v), child) for v, child in node.items()),
+                                  key=lambda cc: cc[0]):
+            if len(best) == count and (cost + floor[level + 1] >= -best[0][0]
+                                       or expanded[0] > PIECE_SEARCH_BUDGET):
+                break
+            if level == last:
+                if len(best) < count:
+                    heappush(best, (-cost, child))
+                else:
+                    heappushpop(best, (-cost, child))
+            else:
+                visit(child, level + 1, cost)
+
+    visit(root, 0, 0.0)
+    return sorted((-c, i) for c, i in best)
+
+
+def solve_heuristic(desired_totals, piece_types, piece_stats, max_solutions=10, allow_tuned=True,
+                    require_exotic=False, total_timeout=None, minimum_constraints=None, catalog=None,
+                    deadline=None, on_solution=None, beam_width=8, restarts=2):
+    """Approximate solve_with_milp_multiple by local search, in tens of milliseconds.
+
+    Takes the same arguments and returns the same (solutions, deviations). A
+    beam search fills the slots one at a time, keeping about beam_width
+    promising partial builds. The best `restarts` complete ones are improved
+    by swapping a slot for the representative that best complements the other
+    four, or two or three slots for copies of one piece, until nothing helps;
+    the best swaps at each local optimum are kept as alternatives. Nothing is
+    proven optimal: this is a fast tier and a starting point for CBC.
+    """
+    if deadline is None:
+        deadline = Deadline(total_timeout)
+    if catalog is None:
+        catalog = _catalog_from_pieces(piece_types, piece_stats)
+    if require_exotic and not any(catalog.exotic_mask):
+        return [], []
+
+    matrix = catalog.stat_matrix
+    n_stats = len(STAT_NAMES)
+    mins = [minimum_constraints.get(s) if minimum_constraints else None for s in STAT_NAMES]
+    # With require_exotic, slot 0 holds the exotic and the other slots can't
+    tries = [_stat_trie(catalog, (slot == 0) if require_exotic else None) for slot in range(5)]
+
+    def candidates(others, slot, count, copies=1, share=1.0):
+        """Best pieces for slot next to others, assuming copies of it fill the rest of the build."""
+        base = [sum(matrix[j][i] for j in others) for i in range(n_stats)]
+        costs = [lambda v, i=i: _stat_cost(base[i] + copies * v, desired_totals[i] * share,
+                                           None if mins[i] is None else mins[i] * share)
+                 for i in range(n_stats)]
+        return _best_pieces(tries[slot], costs, count)
+
+    pool = {}  # sorted rep indices -> deviation, for builds that meet the minimums
+
+    def record(build):
+        key = tuple(sorted(build))
+        if key in pool:
+            return
+        totals = [sum(matrix[j][i] for j in build) for i in range(n_stats)]
+        if all(m is None or t >= m for t, m in zip(totals, mins)):
+            pool[key] = sum(_stat_cost(t, target, None) for t, target in zip(totals, desired_totals))
+
+    # Two guesses at how good a partial build is: its last piece repeated in
+    # the empty slots, or the filled slots on track for their share of the target
+    half = max(1, beam_width // 2)
+    beam = [[]]
+    for slot in range(5):
+        if deadline.expired():
+            deadline.cut_short()
+            break
+        repeated, on_track = {}, {}
+        for partial in beam:
+            for cost, j in candidates(partial, slot, half, copies=5 - slot):
+                build = partial + [j]
+                repeated.setdefault(tuple(sorted(build)), (cost, build))
+            for cost, j in candidates(partial, slot, half, share=(slot + 1) / 5):
+                build = partial + [j]
+                on_track.setdefault(tuple(sorted(build)), (cost, build))
+        kept = {}
+        for extended in (on_track, repeated):
+            for key, cost_build in sorted(extended.items(), key=lambda kcb: kcb[1][0])[:half]:
+                kept.setdefault(key, cost_build)
+        # Once full, both guesses are the build's actual cost
+        beam = [build for _, build in sorted(kept.values(), key=lambda cb: cb[0])]
+
+    for build in beam[:restarts]:
+        if len(build) < 5 or deadline.expired():
+            break
+        current = float("inf")
+        improved = True
+        while improved:
+            improved = False
+            for slot in range(5):
+                others = build[:slot] + build[slot + 1:]
+                cost, best = candidates(others, slot, 1)[0]
+                if cost < current - 1e-9:
+                    build[slot], current = best, cost
+                    improved = True
+            if improved:
+                continue
+            # No single swap helps: try filling two or three slots with copies of one piece
+            for size in (2, 3):
+                for slots in combinations(range(1 if require_exotic else 0, 5), size):
+                    rest = [j for slot, j in enumerate(build) if slot not in slots]
+                    cost, best = candidates(rest, slots[0], 1, copies=size)[0]
+                    if cost < current - 1e-9:
+                        for slot in slots:
+                            build[slot] = best
+                        current = cost
+                        improved = True
+                        break
+                if improved:
+                    break
+
+        # Alternatives: the best swaps for each slot of the local optimum
+        for slot in range(5):
+            others = build[:slot] + build[slot + 1:]
+            for _, j in candidates(others, slot, max_solutions):
+                record(others + [j])
+
+    reps = catalog.rep_types
+    found = []
+    for key, dev in pool.items():
+        sol = {}
+        for j in key:
+            sol[reps[j]] = sol.get(reps[j], 0) + 1
+        found.append((sol, dev))
+    # Closest first, then the same ranking as the MILP
+    found.sort(key=lambda sd: (sd[1], difficulty_score(sd[0])))
+    found = found[:max_solutions]
+    if on_solution is not None:
+        for sol, dev in found:
+            on_solution(sol, dev)
+    found.sort(key=lambda sd: (difficulty_score(sd[0]), sd[1]))
+    return [sol for sol, _ in found], [dev for _, dev in found]
+
+
+# One slice of a parallel enumeration, sent to a worker process
+PartitionTask = namedtuple(
+    "PartitionTask",
+    [
+        "catalog_key",  # get_piece_catalog key, or None for an ad-hoc catalog
+        "pieces",  # (piece_types, piece_stats) when catalog_key is None
+        "desired_totals",
+        "allow_deviation",
+        "require_exotic",
+        "minimum_constraints",
+        "rank_by_difficulty",
+        "tuned_pieces",  # number of tuned pieces in every build of this slice
+        "excluded",  # builds already found, cut off up front
+        "max_solutions",
+        "deviation_bound",  # skip builds that deviate more than this, or None
+        "expires_at",  # time.time() when the slice must be done (tasks may queue), or None
+    ],
+)
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor(workers):
+    """Process pool shared by every parallel solve, sized by the first caller and never replaced.
+
+    Other requests may have tasks in flight on it, so a caller asking for a
+    different worker count shares it as is. Workers are spawned (not forked),
+    so they never inherit locks held by the server's other threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def partition_tasks(catalog, **task_fields):
+    """Split the search into disjoint slices by tuned-piece count (a single slice if nothing is tuned)."""
+    pieces = None if catalog.key is not None else (catalog.piece_types, dict(catalog.piece_stats))
+    counts = range(6) if any(catalog.tuned_mask) else [None]
+    return [PartitionTask(catalog_key=catalog.key, pieces=pieces, tuned_pieces=t, **task_fields)
+            for t in counts]
+
 
-    # Phase 1: find exact solutions (no timeout)
-    while len(solutions) < max_solutions:
-        sol, dev = solve_problem(allow_deviation=False)
+def _enumerate_partition(task):
+    """Worker entry point: up to task.max_solutions builds from one slice, plus whether time ran out."""
+    if task.catalog_key is not None:
+        catalog = _build_catalog(*task.catalog_key)
+    else:
+        catalog = _catalog_from_pieces(*task.pieces)
+    deadline = Deadline(None if task.expires_at is None else task.expires_at - time.time())
+    session = MilpSession(task.desired_totals, catalog, allow_deviation=task.allow_deviation,
+                          require_exotic=task.require_exotic, minimum_constraints=task.minimum_constraints,
+                          rank_by_difficulty=task.rank_by_difficulty, tuned_pieces=task.tuned_pieces)
+    for sol in task.excluded:
+        session.exclude(sol)
+    if task.deviation_bound is not None:
+        session.bound_deviation(task.deviation_bound)
+
+    found = []
+    while len(found) < task.max_solutions:
+        time_limit = deadline.solver_time_limit()
+        if time_limit is not None and time_limit < MIN_CBC_SECONDS:
+            deadline.cut_short()
+            break
+        sol, dev = session.solve(time_limit=time_limit)
+        if session.stopped_early:
+            deadline.cut_short()
         if not sol:
             break
-        if sol not in solutions:
-            solutions.append(sol)
-            deviations.append(dev)
-        exclusions.append(list(sol.keys()))
-
-    # Phase 2: approximations if needed (with timeout)
-    if not solutions:
-        exclusions = []
-        # Reset start time for Phase 2 timeout
-        start_time = time.time()
+        found.append((sol, dev))
+        session.exclude(sol)
+    return found, deadline.partial
+
+
+def enumerate_in_parallel(tasks, workers):
+    """Run partition tasks on a process pool; yields (builds, partial) as each slice finishes."""
+    executor = _get_executor(workers)
+    futures = [executor.submit(_enumerate_partition, task) for task in tasks]
+    for future in as_completed(futures):
+        yield future.result()
+
+
+def solve_with_milp_multiple(desired_totals, piece_types, piece_stats, max_solutions=10, allow_tuned=True,
+                             require_exotic=False, total_timeout=120, minimum_constraints=None, catalog=None,
+                             solution_pool=False, deadline=None, on_solution=None, workers=1, hints=None,
+                             stats=None):
+    """Find up to max_solutions 5-piece builds, exact matches first, then closest approximations.
+
+    Pass the PieceCatalog the pieces came from as `catalog` to reuse its
+    precomputed representatives and masks instead of recomputing them.
+
+    solution_pool=True enumerates the k best distinct builds by
+    (difficulty_score, deviation) from one CBC model instead of the fast
+    fewest-tuned-pieces search; slower, but the ranking is exact.
+
+    total_timeout is a hard budget for the whole call (pass a Deadline to share
+    one with the caller). When it runs out the builds found so far are
+    returned and deadline.partial is set.
+
+    on_solution(sol, deviation) is called as soon as each build is accepted,
+    in discovery order, so callers can stream results before the search ends.
+    The returned lists are ranked by (difficulty_score, deviation) instead.
+
+    workers > 1 runs each CBC phase as disjoint slices (see partition_tasks)
+    on that many worker processes and keeps the best max_solutions overall.
+
+    hints are builds from a similar request (e.g. the cached solutions of a
+    nearby target). Valid ones warm-start CBC, exact matches in Phase 1 and
+    the rest in Phase 2. Phase 2 also starts from solve_heuristic's builds;
+    max_solutions known builds bound the deviation search from the start, and
+    they are returned if CBC runs out of time.
+
+    Pass a SolveStats as stats to see where the time went.
+    """
+    if deadline is None:
+        deadline = Deadline(total_timeout)
+    if stats is None:
+        stats = SolveStats()
+
+    # One variable per distinct stat vector; callers expand with expand_equivalents()
+    if catalog is None:
+        catalog = _catalog_from_pieces(piece_types, piece_stats)
+    piece_types, piece_stats = catalog.rep_types, catalog.rep_stats
+
+    solutions = []
+    deviations = []
+    phase_started = time.perf_counter()
+
+    def accept(sol, dev):
+        if sol in solutions:
+            stats.duplicates += 1
+            return
+        solutions.append(sol)
+        deviations.append(dev)
+        if on_solution is not None:
+            on_solution(sol, dev)
+
+    # Bounds and residues that rule out an exact match skip straight to Phase 2;
+    # impossible minimum constraints raise InfeasibleRequest
+    with stats.timed("prescreen"):
+        exact_blocker = prescreen(desired_totals, catalog, require_exotic=require_exotic,
+                                  minimum_constraints=minimum_constraints)
+
+    # Fast-path identical only when no exotic is required
+    if exact_blocker is None and not require_exotic and not solution_pool:
+        with stats.timed("identical"):
+            ident = identical_piece_check(desired_totals, piece_types, piece_stats, catalog=catalog)
+        if ident:
+            accept(ident, 0.0)
+
+    # Hints that are valid builds here, closest first
+    vetted = []
+    for sol in hints or ():
+        dev = build_deviation(sol, desired_totals, catalog, require_exotic, minimum_constraints)
+        if dev is not None and sol not in [s for _, s in vetted]:
+            vetted.append((dev, sol))
+    vetted.sort(key=lambda ds: ds[0])
+    exact_hints = [sol for dev, sol in vetted if dev == 0]
+    # Known approximate builds as (deviation, build), closest first; set before Phase 2
+    approximations = [(dev, sol) for dev, sol in vetted if dev > 0]
+    deviation_bound = None
+
+    sessions = {}
+
+    def solve_problem(allow_deviation=False):
+        time_limit = deadline.solver_time_limit()
+        if time_limit is not None and not allow_deviation and not solutions:
+            # Nothing exact yet: keep half of what's left for approximations
+            time_limit /= 2
+        if time_limit is not None and time_limit < MIN_CBC_SECONDS:
+            deadline.cut_short()
+            return None, None
+        session = sessions[allow_deviation]
+        with stats.cbc_call():
+            result = session.solve(time_limit=time_limit)
+        stats.iterations += 1
+        if session.stopped_early:
+            deadline.cut_short()
+        return result
+
+    def enumerate_partitions(allow_deviation):
+        # Every slice shares one cutoff and runs to max_solutions on its own
+        time_limit = deadline.remaining()
+        if time_limit is not None:
+            if not allow_deviation and not solutions:
+                time_limit /= 2  # Nothing exact yet: keep half of what's left for approximations
+            if time_limit <= CBC_OVERHEAD_SECONDS:
+                deadline.cut_short()
+                return
+        tasks = partition_tasks(catalog, desired_totals=list(desired_totals), allow_deviation=allow_deviation,
+                                require_exotic=require_exotic, minimum_constraints=minimum_constraints,
+                                rank_by_difficulty=solution_pool, excluded=list(solutions),
+                                max_solutions=max_solutions - len(solutions),
+                                deviation_bound=deviation_bound if allow_deviation else None,
+                                expires_at=None if time_limit is None else time.time() + time_limit)
+        with stats.timed("partitions"):
+            for found, partial in enumerate_in_parallel(tasks, workers):
+                if partial:
+                    deadline.cut_short()
+                for sol, dev in found:
+                    accept(sol, dev)
+
+    def open_session(allow_deviation):
+        # Built once per phase; later iterations only add exclusion cuts
+        with stats.timed("model_build"):
+            sessions[allow_deviation] = MilpSession(desired_totals, catalog, allow_deviation=allow_deviation,
+                                                    require_exotic=require_exotic,
+                                                    minimum_constraints=minimum_constraints,
+                                                    rank_by_difficulty=solution_pool)
+        return sessions[allow_deviation]
+
+    # Phase 1a: exact solutions by table lookup; CBC only runs when that can't settle the query
+    from exact_solver import solve_exact  # imported here: exact_solver builds on this module
+    run_exact_milp = exact_blocker is None
+    seeds = []
+    exact = None
+    if run_exact_milp:
+        with stats.timed("exact_lookup"):
+            exact = solve_exact(desired_totals, catalog, max_solutions=max_solutions, require_exotic=require_exotic,
+                                minimum_constraints=minimum_constraints, deadline=deadline)
+    if exact is not None:
+        exact_solutions, exhausted = exact
+        if solution_pool:
+            # Lookups rank by a heuristic piece assignment, so they only seed CBC's
+            # incumbent (or prove infeasibility) instead of being returned as-is
+            seeds = exact_solutions
+            run_exact_milp = not (exhausted and not exact_solutions)
+        else:
+            for sol in exact_solutions:
+                accept(sol, 0.0)
+            run_exact_milp = not exhausted and len(solutions) < max_solutions
+
+    # Exact hints are incumbents for CBC (and still count if time runs out)
+    seeds = seeds + [sol for sol in exact_hints if sol not in seeds]
+
+    # Phase 1b: find remaining exact solutions with CBC
+    if workers > 1 and run_exact_milp and len(solutions) < max_solutions and not deadline.expired():
+        enumerate_partitions(allow_deviation=False)
+    elif run_exact_milp and len(solutions) < max_solutions and not deadline.expired():
+        session = open_session(allow_deviation=False)
+        for sol in solutions:
+            session.exclude(sol)
+        # With nothing found yet, an infeasible LP relaxation settles it without branching
+        relaxed_feasible = bool(solutions)
+        if not relaxed_feasible:
+            with stats.cbc_call():
+                relaxed_feasible = session.relaxation_feasible()
+        while relaxed_feasible and len(solutions) < max_solutions:
+            if deadline.expired():
+                deadline.cut_short()
+                break
+            seed = next((s for s in seeds if s not in solutions), None)
+            if seed is not None:
+                session.warm_start(seed)
+            sol, dev = solve_problem(allow_deviation=False)
+            if not sol:
+                break
+            accept(sol, dev)
+            session.exclude(sol)
+
+    # Out of time before CBC ranked everything: the lookup builds are still exact matches
+    if deadline.partial:
+        for sol in seeds:
+            if len(solutions) < max_solutions:
+                accept(sol, 0.0)
+
+    stats.add("phase1", time.perf_counter() - phase_started)
+
+    # Phase 2: approximations if needed
+    approximating = not solutions
+    phase_started = time.perf_counter()
+    if approximating:
+        # Local search takes milliseconds; its builds warm-start CBC, bound it, and stand in if it runs out of time
+        with stats.timed("heuristic"):
+            quick, quick_devs = solve_heuristic(desired_totals, piece_types, piece_stats,
+                                                max_solutions=max_solutions, require_exotic=require_exotic,
+                                                minimum_constraints=minimum_constraints, catalog=catalog)
+        known = [sol for _, sol in approximations]
+        approximations += [(dev, sol) for sol, dev in zip(quick, quick_devs) if sol not in known]
+        approximations.sort(key=lambda ds: ds[0])
+        # The best max_solutions builds can't deviate more than the max_solutions-th known one;
+        # the slack covers the tie-breaking terms of the objective
+        if len(approximations) >= max_solutions:
+            deviation_bound = approximations[max_solutions - 1][0] + 0.2
+
+    if not solutions and deadline.expired():
+        # No time left for CBC: the heuristic's builds below stand in
+        deadline.cut_short()
+    if workers > 1 and not solutions and not deadline.expired():
+        enumerate_partitions(allow_deviation=True)
+    elif not solutions and not deadline.expired():
+        session = open_session(allow_deviation=True)
+        if deviation_bound is not None:
+            session.bound_deviation(deviation_bound)
         while len(solutions) < max_solutions:
-            # Check if we've exceeded total timeout
-            if time.time() - start_time >= total_timeout:
+            if deadline.expired():
+                deadline.cut_short()
                 break
-                
-            sol, dev = solve_problem(allow_deviation=True, use_timeout=True)
+
+            seed = next((s for _, s in approximations if s not in solutions), None)
+            if seed is not None:
+                session.warm_start(seed)
+            sol, dev = solve_problem(allow_deviation=True)
             if not sol:
                 break
-            if sol not in solutions:
-                solutions.append(sol)
-                deviations.append(dev)
-            exclusions.append(list(sol.keys()))
+            accept(sol, dev)
+            session.exclude(sol)
+
+    # Out of time before CBC finished: the known builds fill the remaining places, closest first
+    if approximating and deadline.partial:
+        for dev, sol in approximations:
+            if len(solutions) < max_solutions:
+                accept(sol, dev)
+    if approximating:
+        stats.add("phase2", time.perf_counter() - phase_started)
 
     combined = list(zip(solutions, deviations))
+    if len(combined) > max_solutions:
+        # Parallel slices can together return more; keep the closest, as the sequential search would
+        combined.sort(key=lambda sd: (sd[1], difficulty_score(sd[0])))
+        combined = combined[:max_solutions]
     combined.sort(key=lambda sd: (difficulty_score(sd[0]), sd[1]))
     if combined:
         solutions, deviations = zip(*combined)
@@ -329,6 +1365,91 @@ def solve_with_milp_multiple(desired_totals, piece_types, piece_stats, max_solut
     return solutions, deviations
 
 
+# ----------------------------
+# Batch solving
+# ----------------------------
+
+# One distinct target of a batch, sent to a worker process
+BatchTask = namedtuple(
+    "BatchTask",
+    [
+        "catalog_key",  # get_piece_catalog key, or None for an ad-hoc catalog
+        "pieces",  # (piece_types, piece_stats) when catalog_key is None
+        "desired_totals",
+        "max_solutions",
+        "require_exotic",
+        "minimum_constraints",
+        "time_limit",  # seconds for this target
+        "expires_at",  # time.time() when the whole batch must be done, or None
+    ],
+)
+
+# indices: every position in the batch that asked for this target
+BatchResult = namedtuple("BatchResult", ["indices", "solutions", "deviations", "partial", "error", "seconds"])
+
+
+def _solve_batch_task(task):
+    """Solve one batch target; returns (solutions, deviations, partial, error message or None, seconds)."""
+    start_time = time.time()
+    if task.catalog_key is not None:
+        catalog = _build_catalog(*task.catalog_key)
+    else:
+        catalog = _catalog_from_pieces(*task.pieces)
+    time_limit = task.time_limit
+    if task.expires_at is not None:
+        time_limit = min(time_limit, max(0.0, task.expires_at - time.time()))
+    deadline = Deadline(time_limit)
+    try:
+        solutions, deviations = solve_with_milp_multiple(
+            task.desired_totals, catalog.piece_types, catalog.piece_stats, max_solutions=task.max_solutions,
+            require_exotic=task.require_exotic, minimum_constraints=task.minimum_constraints,
+            catalog=catalog, deadline=deadline)
+    except InfeasibleRequest as e:
+        return [], [], False, str(e), time.time() - start_time
+    return solutions, deviations, deadline.partial, None, time.time() - start_time
+
+
+def solve_batch(targets, catalog, max_solutions=10, require_exotic=False, minimum_constraints=None,
+                per_target_timeout=120, deadline=None, workers=1):
+    """Solve many stat targets that share one catalog configuration.
+
+    Identical targets are solved once. Yields a BatchResult per distinct
+    target as soon as it finishes (completion order, not input order). Each
+    target gets per_target_timeout seconds, capped by the batch deadline.
+    workers > 1 fans targets out over the shared process pool; a target that
+    runs out of batch time before it starts comes back empty and partial.
+    """
+    if deadline is None:
+        deadline = Deadline()
+    pieces = None if catalog.key is not None else (catalog.piece_types, dict(catalog.piece_stats))
+
+    positions = {}
+    for i, totals in enumerate(targets):
+        positions.setdefault(tuple(int(v) for v in totals), []).append(i)
+
+    def task_for(totals):
+        remaining = deadline.remaining()
+        return BatchTask(catalog_key=catalog.key, pieces=pieces, desired_totals=list(totals),
+                         max_solutions=max_solutions, require_exotic=require_exotic,
+                         minimum_constraints=minimum_constraints, time_limit=per_target_timeout,
+                         expires_at=None if remaining is None else time.time() + remaining)
+
+    if workers <= 1:
+        for totals, indices in positions.items():
+            if deadline.expired():
+                deadline.cut_short()
+                yield BatchResult(indices, [], [], True, None, 0.0)
+                continue
+            yield BatchResult(indices, *_solve_batch_task(task_for(totals)))
+        return
+
+    executor = _get_executor(workers)
+    futures = {executor.submit(_solve_batch_task, task_for(totals)): indices
+               for totals, indices in positions.items()}
+    for future in as_completed(futures):
+        yield BatchResult(futures[future], *future.result())
+
+
 # ----------------------------
 # Reporting
 # ----------------------------
@@ -351,21 +1472,19 @@ def format_solution(sol, deviation=0.0, desired_stats=None, piece_stats=None):
     # Group identical pieces by their string representation for display
     piece_groups = defaultdict(int)
     for p, count in sol.items():
+        prefix = "[EXOTIC] " if is_exotic_piece(p) else ""
         if p.tuning_mode == "balanced":
-            prefix = "[EXOTIC] " if str(p.arch).lower().startswith("exotic ") else ""
             key = f"{prefix}{p.arch} (tertiary={p.tertiary}) Balanced Tuning (+1 to 3 lowest stats)"
         elif p.tuning_mode == "tuned":
-            prefix = "[EXOTIC] " if str(p.arch).lower().startswith("exotic ") else ""
             key = f"{prefix}{p.arch} (tertiary={p.tertiary}) No specific tuning required"
             # Track the tuning requirement separately
             tuning_requirements[p.tuned_stat] += count
             # This piece can be flexible for other tuning needs
             flexible_pieces += count
         else:
-            prefix = "[EXOTIC] " if str(p.arch).lower().startswith("exotic ") else ""
             key = f"{prefix}{p.arch} (tertiary={p.tertiary}) No tuning required"
             # Non-exotic, non-balanced pieces can accept any +5/-5 tuning
-            if not str(p.arch).lower().startswith("exotic "):
+            if not is_exotic_piece(p):
                 flexible_pieces += count
         piece_groups[key] += count
         mods[p.mod_target] += count
@@ -455,7 +1574,7 @@ if __name__ == "__main__":
         max_solutions=10,
         allow_tuned=allow_tuned,
         require_exotic=use_exotic,
-        total_timeout=30  # 30 second timeout for Phase 2 only
+        total_timeout=30  # 30 second budget for the whole search
     )
     if not sols:
         print("No solutions found.")
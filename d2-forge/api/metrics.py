@@ -0,0 +1,42 @@
+from http.server import BaseHTTPRequestHandler
+import hmac
+import sys
+import os
+
+# Add the current directory to Python path so we can import our modules
+sys.path.append(os.path.dirname(__file__))
+
+from metrics_registry import registry
+from cache import optimization_cache
+
+# Scrapers must send "Authorization: Bearer <token>" when this is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# The disk tier is shared by every process on the host, so it is measured here, once per scrape
+registry.gauge('d2forge_cache_disk_files', 'Files in the disk cache',
+               function=lambda: optimization_cache.disk_usage()[0], merge='max')
+registry.gauge('d2forge_cache_disk_bytes', 'Bytes in the disk cache',
+               function=lambda: optimization_cache.disk_usage()[1], merge='max')
+
+class handler(BaseHTTPRequestHandler):
+    """GET /api/metrics
+
+    Counters, gauges and histograms of every function process on this host,
+    in the Prometheus text format (see metrics_registry.py).
+    """
+
+    def do_GET(self):
+        try:
+            if METRICS_TOKEN and not hmac.compare_digest(self.headers.get('Authorization', ''),
+                                                         f"Bearer {METRICS_TOKEN}"):
+                self.send_error(401, "Missing or wrong metrics token")
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+        except Exception as e:
+            self.send_error(500, f"Failed to render metrics: {str(e)}")
@@ -0,0 +1,262 @@
+"""
+In-process metrics (counters, gauges and fixed-bucket histograms), served by
+/api/metrics (metrics.py) in the Prometheus text format.
+
+Metrics are declared next to the code that updates them:
+
+    CACHE_LOOKUPS = registry.counter('d2forge_cache_lookups_total', 'Cache lookups', ['result'])
+    CACHE_LOOKUPS.inc(result='miss')
+
+Every function runs in its own process, so each one writes a snapshot of its
+registry under METRICS_DIR when it finishes a request (registry.flush()).
+/api/metrics adds up the snapshots of every process on the host. Function
+instances don't share /tmp, so on Vercel it only sees processes on the
+instance that served the scrape.
+"""
+
+from collections import defaultdict
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/d2forge_metrics')
+# Snapshots of processes that stopped writing this long ago are dropped
+SNAPSHOT_MAX_AGE_SECONDS = 24 * 3600
+
+# Request and solver latencies, in seconds (the request budget is 15 s)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = registry._lock
+        self._values = {}  # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def describe(self):
+        return {"type": self.kind, "help": self.help, "labelnames": list(self.labelnames)}
+
+    def samples(self):
+        """[(label values, value)] as stored in a snapshot."""
+        with self._lock:
+            return [[list(k), v] for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A current value. With function, it is read when a snapshot is taken:
+    function() returns the value, or {label values tuple: value} for labelled gauges.
+
+    merge says how processes combine: "sum" for per-process values (entries
+    held in memory), "max" for host-wide ones every process sees (disk usage).
+    """
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, labelnames, function=None, merge="sum"):
+        super().__init__(registry, name, help, labelnames)
+        self.function = function
+        self.merge = merge
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def describe(self):
+        return dict(super().describe(), merge=self.merge)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [[list(map(str, k)), v] for k, v in value.items()]
+        return [[[], value]]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labelnames, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            # counts[i] holds observations in (buckets[i-1], buckets[i]]; the last one is +Inf
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            entry["counts"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def describe(self):
+        return dict(super().describe(), buckets=list(self.buckets))
+
+    def samples(self):
+        with self._lock:
+            return [[list(k), dict(v, counts=list(v["counts"]))] for k, v in self._values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(self, name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"{name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=(), function=None, merge="sum"):
+        return self._register(Gauge, name, help, labelnames, function=function, merge=merge)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        return {name: dict(metric.describe(), samples=metric.samples()) for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self):
+        return os.path.join(self.metrics_dir, f"{os.getpid()}.json")
+
+    def flush(self):
+        """Publish this process's values for /api/metrics (best effort)."""
+        if not self.metrics_dir or not self._metrics:
+            return
+        path = self._snapshot_path()
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _host_snapshots(self):
+        """This process's live snapshot plus every other process's published one."""
+        snapshots = [self.snapshot()]
+        if not self.metrics_dir:
+            return snapshots
+        own = self._snapshot_path()
+        now = time.time()
+        for path in glob.glob(os.path.join(self.metrics_dir, '*.json')):
+            if path == own:
+                continue
+            try:
+                if now - os.path.getmtime(path) > SNAPSHOT_MAX_AGE_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """All metrics on this host in the Prometheus text exposition format."""
+        merged = {}
+        for snapshot in self._host_snapshots():
+            for name, metric in snapshot.items():
+                into = merged.setdefault(name, dict(metric, samples=defaultdict(lambda: None)))
+                if into.get("buckets") != metric.get("buckets") or into["type"] != metric["type"]:
+                    continue  # declared differently by another build; keep the first
+                for labels, value in metric["samples"]:
+                    key = tuple(labels)
+                    into["samples"][key] = _merge(into, into["samples"][key], value)
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {_escape_help(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric["samples"].items()):
+                labels = list(zip(metric["labelnames"], key))
+                if metric["type"] == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric["buckets"] + [math.inf], value["counts"]):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(metric, current, value):
+    if current is None:
+        return value
+    if metric["type"] == "histogram":
+        return {"counts": [a + b for a, b in zip(current["counts"], value["counts"])],
+                "sum": current["sum"] + value["sum"], "count": current["count"] + value["count"]}
+    if metric["type"] == "gauge" and metric.get("merge") == "max":
+        return max(current, value)
+    return current + value
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+# Global registry shared by every module of a function
+registry = MetricsRegistry()
@@ -0,0 +1,230 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import sys
+import os
+import time
+
+# Add the current directory to Python path so we can import our modules
+sys.path.append(os.path.dirname(__file__))
+
+from main import solve_batch, get_piece_catalog, STAT_NAMES, Deadline
+from timing import request_timer, NULL_TIMER
+from cache import optimization_cache
+from rate_limiter import rate_limiter, solve_slots, COST_EXACT, COST_APPROXIMATE
+from optimize import (REQUEST_TIMEOUT_SECONDS, SOLVER_WORKERS, SHED_RETRY_AFTER_SECONDS, solution_to_json,
+                      build_response, canonicalize_request, desired_totals_from, stream_format, SolutionStream,
+                      record_request, send_refusal, popular_responses, refresh_stale)
+from http_response import send_json_error
+
+# Each distinct target a batch solves is charged like a single solve; cached targets are free.
+# A batch reserves every target's worst case (an approximate solve) from what the client's bucket
+# holds, solves targets while the reservation covers them, refuses the rest and refunds what the
+# solves didn't use, so it never leaves the client in debt
+MAX_BATCH_TARGETS = 500
+BATCH_TIMEOUT_SECONDS = 300
+
+
+def result_cost(result):
+    """Tokens a solved batch target costs: like solve_cost(), approximations cost more."""
+    if result.error or (result.solutions and result.deviations[0] == 0):
+        return COST_EXACT
+    return COST_APPROXIMATE
+
+class handler(BaseHTTPRequestHandler):
+    """POST {"targets": [{"Health": ..., ...}, ...], <same options as /api/optimize>}
+
+    Streams one {"type": "result", "index": i, "target": {...}, "response": {...}}
+    event per target (NDJSON, or SSE with Accept: text/event-stream), in
+    completion order, followed by a {"type": "summary"} event. Each response
+    has the same shape as /api/optimize and shares its cache.
+    """
+
+    timer = NULL_TIMER
+    status = None  # as sent, for metrics
+    cache_status = None
+
+    def do_POST(self):
+        start_time = time.time()
+        timer = self.timer = request_timer('optimize-batch')
+        deadline = Deadline(BATCH_TIMEOUT_SECONDS)
+        stream = None
+        slot = None
+        prepaid = spent = 0
+        try:
+            # Get client IP for rate limiting
+            client_ip = self.headers.get('X-Forwarded-For', self.client_address[0]).split(',')[0].strip()
+
+            with timer.span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                request_data = json.loads(post_data.decode('utf-8'))
+
+            targets = request_data.get('targets')
+            if not isinstance(targets, list) or not targets:
+                send_json_error(self, 400, "targets must be a non-empty list of stat objects")
+                return
+            if len(targets) > MAX_BATCH_TARGETS:
+                send_json_error(self, 400, f"At most {MAX_BATCH_TARGETS} targets per batch")
+                return
+            # Each target is canonicalized and looked up exactly as a single /api/optimize request would be
+            shared = {k: v for k, v in request_data.items() if k != 'targets' and k not in STAT_NAMES}
+            try:
+                target_requests = [canonicalize_request(dict(shared, **{stat: target.get(stat, 0) for stat in STAT_NAMES}))
+                                   for target in targets]
+            except (ValueError, AttributeError) as e:
+                send_json_error(self, 400, f"Invalid batch request: {e}")
+                return
+            first = target_requests[0]
+            options = {k: first[k] for k in ('allow_tuned', 'use_exotic', 'use_class_item_exotic', 'exotic_perks')}
+            minimum_constraints = first['minimum_constraints']
+
+            # Cached targets go out first, the rest are solved. Like /api/optimize, the pack is checked
+            # before the TTL cache, and a stale hit is served while one request refreshes it
+            cached = []
+            pending = []
+            for i, target_request in enumerate(target_requests):
+                if popular_responses:
+                    with timer.span('pack'):
+                        packed = popular_responses.get(optimization_cache.key_for(target_request))
+                    if packed:
+                        cached.append((i, json.loads(packed)))
+                        continue
+                with timer.span('cache'):
+                    hit = optimization_cache.lookup(target_request)
+                if hit:
+                    refresh_stale(target_request, hit)
+                    response = json.loads(hit.body)
+                    if hit.stale:
+                        response['stale'] = True
+                    cached.append((i, response))
+                else:
+                    pending.append(i)
+            # Identical targets are solved (and charged) once
+            groups = {}
+            for i in pending:
+                groups.setdefault(tuple(desired_totals_from(target_requests[i])), []).append(i)
+            groups = list(groups.items())
+
+            # Refused before the stream starts, so the status code can still say why
+            if groups:
+                # 429 unless the bucket covers at least one target
+                is_allowed, retry_after = rate_limiter.is_allowed(client_ip, COST_APPROXIMATE)
+                if not is_allowed:
+                    send_refusal(self, 429, retry_after,
+                                 "Rate limit exceeded. Please wait before making another request.")
+                    return
+                prepaid = COST_APPROXIMATE + rate_limiter.take_up_to(client_ip,
+                                                                     (len(groups) - 1) * COST_APPROXIMATE)
+                with timer.span('queue'):
+                    slot = solve_slots.acquire(timeout=REQUEST_TIMEOUT_SECONDS)
+                if slot is None:
+                    send_refusal(self, 503, SHED_RETRY_AFTER_SECONDS, "Server busy. Please try again shortly.")
+                    return
+
+            stream = SolutionStream(self, stream_format(self.headers.get('Accept')) or 'ndjson')
+            summary = {"targets": len(targets), "cached": len(cached), "solved": 0, "rate_limited": 0,
+                       "partial": False}
+
+            def send_result(index, response):
+                target = {stat: target_requests[index][stat] for stat in STAT_NAMES}
+                stream.send('result', {"index": index, "target": target, "response": response})
+
+            for i, response in cached:
+                send_result(i, response)
+
+            if groups:
+                with timer.span('catalog'):
+                    catalog = get_piece_catalog(**options)
+                # One solve slot per round of SOLVER_WORKERS targets (a single solve with that many
+                # workers holds one too), taken again each round so single requests can get in between
+                chunk_size = max(1, SOLVER_WORKERS)
+                start = 0
+                while start < len(groups):
+                    # Only as many targets as the rest of the reservation covers at their worst
+                    affordable = int((prepaid - spent) // COST_APPROXIMATE)
+                    if affordable < 1:
+                        # Out of tokens: the rest of the batch is refused, to be sent again later
+                        for _, indices in groups[start:]:
+                            summary['rate_limited'] += len(indices)
+                            for index in indices:
+                                send_result(index, {"solutions": [], "partial": False,
+                                                    "error": "Rate limit reached before this target was solved"})
+                        break
+                    chunk = groups[start:start + min(chunk_size, affordable)]
+                    start += len(chunk)
+                    if slot is None:
+                        with timer.span('queue'):
+                            slot = solve_slots.acquire(timeout=min(REQUEST_TIMEOUT_SECONDS, deadline.remaining()))
+                    if slot is None:
+                        # No slot freed up in time: the rest of the batch comes back empty and partial
+                        summary['partial'] = True
+                        for _, indices in groups[start - len(chunk):]:
+                            for index in indices:
+                                send_result(index, build_response([], 0.0, True))
+                        break
+                    solve_started = time.perf_counter()
+                    try:
+                        for result in solve_batch(
+                            [list(totals) for totals, _ in chunk],
+                            catalog,
+                            max_solutions=8,
+                            require_exotic=options['use_exotic'],
+                            minimum_constraints=minimum_constraints,
+                            per_target_timeout=REQUEST_TIMEOUT_SECONDS,
+                            deadline=deadline,
+                            workers=SOLVER_WORKERS
+                        ):
+                            if result.error:
+                                response = {"solutions": [], "error": result.error, "partial": False}
+                            else:
+                                formatted = [solution_to_json(sol, dev, catalog.piece_stats, catalog.equivalents)
+                                             for sol, dev in zip(result.solutions, result.deviations)]
+                                response = build_response(formatted, round(result.seconds, 2), result.partial)
+                            spent += result_cost(result)
+                            summary['solved'] += 1
+                            summary['partial'] = summary['partial'] or result.partial
+                            for j in result.indices:
+                                for index in chunk[j][1]:
+                                    if not result.partial and not result.error:
+                                        optimization_cache.set(target_requests[index], response)
+                                    send_result(index, response)
+                    finally:
+                        solve_slots.release(slot)
+                        slot = None
+                    timer.add('solve', time.perf_counter() - solve_started)
+
+            summary['compute_time_seconds'] = round(time.time() - start_time, 2)
+            stream.send('summary', summary)
+            timer.note(targets=summary['targets'], cached=summary['cached'], solved=summary['solved'],
+                       partial=summary['partial'])
+
+        except Exception as e:
+            if stream and stream.started:
+                # Status line already sent; end the stream with an error event instead
+                stream.send('error', {"error": f"Batch optimization failed: {str(e)}"})
+                return
+            send_json_error(self, 500, f"Batch optimization failed: {str(e)}")
+        finally:
+            if slot is not None:
+                solve_slots.release(slot)
+            # Settle up: give back the reservation the solves didn't use
+            if prepaid > spent:
+                rate_limiter.refund(client_ip, prepaid - spent)
+            timer.log()
+            record_request('optimize-batch', self, time.time() - start_time)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def send_error(self, code, message=None, explain=None):
+        self.timer.note(status=code)
+        super().send_error(code, message, explain)
+
+    def do_OPTIONS(self):
+        # Handle CORS preflight
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
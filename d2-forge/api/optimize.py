@@ -1,199 +1,719 @@
+from collections import namedtuple
+from functools import lru_cache
 from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlencode, urlsplit
+import hashlib
 import json
+import multiprocessing
 import sys
 import os
+import threading
 import time
 
 # Add the current directory to Python path so we can import our modules
 sys.path.append(os.path.dirname(__file__))
 
-from main import solve_with_milp_multiple, generate_piece_types, STAT_NAMES, calculate_actual_stats, CLASS_ITEM_ROLLS
-from cache import optimization_cache
-from rate_limiter import rate_limiter
+from main import (solve_with_milp_multiple, get_piece_catalog, STAT_NAMES, calculate_actual_stats, CLASS_ITEM_ROLLS,
+                  expand_equivalents, Deadline, catalog_key, stat_bounds, PieceType,
+                  is_exotic_piece, SolveStats)
+from cache import optimization_cache, CachedResponse
+from rate_limiter import rate_limiter, solve_slots, COST_EXACT, COST_APPROXIMATE
+from singleflight import optimize_flights
+from response_pack import load_pack
+from http_response import StaticBody, send_body, send_json_error, make_etag, RESULT_CACHE_CONTROL
+from timing import request_timer, NULL_TIMER
+from metrics_registry import registry
+from solver_pool import SolverPool, PoolTask, PoolBusy, solve_priority, PRIORITY_BACKGROUND
+
+REQUEST_TIMEOUT_SECONDS = 15
+# A solve waits at most this share of its budget for a solve slot before the request is shed
+MAX_QUEUE_SHARE = 1 / 3
+SHED_RETRY_AFTER_SECONDS = 5
+# Vercel functions get a single CPU; self-hosted boxes can set this to their core count
+SOLVER_WORKERS = int(os.environ.get('SOLVER_WORKERS', '1'))
+# Pre-warmed solver processes for servers that answer many requests from one process (see solver_pool.py).
+# 0 (the default, and right for Vercel) solves on the request thread under the host's solve slots
+SOLVER_POOL_SIZE = int(os.environ.get('SOLVER_POOL_SIZE', '0'))
+# Catalogs the pool's workers build before taking work: the default options, with and without tuning
+POOL_WARM_CATALOGS = [
+    {'allow_tuned': True, 'use_exotic': False, 'use_class_item_exotic': False, 'exotic_perks': None},
+    {'allow_tuned': False, 'use_exotic': False, 'use_class_item_exotic': False, 'exotic_perks': None},
+]
+
+# Accept header value -> streaming wire format (opt-in; plain JSON otherwise)
+STREAM_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'text/event-stream': 'sse',
+}
+
+# ?v=N on /api/optimize. v1 keys pieces by their JSON descriptor; v2 refers
+# to them by position in the catalog document served by /api/catalog
+WIRE_VERSIONS = (1, 2)
+# Column order of a catalog document row (and of a v1 piece descriptor)
+PIECE_FIELDS = ('arch', 'tertiary', 'tuning_mode', 'mod_target', 'tuned_stat', 'siphon_from')
+
+# Served by /api/metrics (see metrics_registry.py)
+REQUESTS = registry.counter('d2forge_requests_total', 'Requests answered, by endpoint, status and cache status',
+                            ['endpoint', 'status', 'cache'])
+REQUEST_SECONDS = registry.histogram('d2forge_request_seconds', 'Request latency, by endpoint and cache status',
+                                     ['endpoint', 'cache'])
+SOLVES = registry.counter('d2forge_solves_total',
+                          '/api/optimize solves (including background revalidations), by whether they fell through to '
+                          'approximations (phase 2) and whether they ran out of time', ['phase', 'partial'])
+CBC_CALLS_PER_SOLVE = registry.histogram('d2forge_cbc_calls_per_solve',
+                                         'CBC runs per solve (only runs made in the request process)',
+                                         buckets=(0, 1, 2, 4, 8, 16, 32, 64))
+CBC_CALL_SECONDS = registry.histogram('d2forge_cbc_call_seconds', 'Duration of each CBC run')
+
+def approximated(stats):
+    """Whether a solve fell through to approximations (phase 2)."""
+    return 'phase2' in stats.stages
+
+def solve_cost(stats):
+    """Rate limiter tokens a finished solve costs."""
+    return COST_APPROXIMATE if approximated(stats) else COST_EXACT
+
+def record_solve(stats, partial):
+    SOLVES.inc(phase='approximate' if approximated(stats) else 'exact', partial=str(partial).lower())
+    CBC_CALLS_PER_SOLVE.observe(len(stats.cbc_calls))
+    for seconds in stats.cbc_calls:
+        CBC_CALL_SECONDS.observe(seconds)
+
+def record_request(endpoint, request_handler, seconds):
+    """Count a finished request; status and cache status are read off the handler."""
+    status = str(request_handler.status or 'none')
+    cache_status = request_handler.cache_status or 'none'
+    REQUESTS.inc(endpoint=endpoint, status=status, cache=cache_status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint, cache=cache_status)
+    # Published for /api/metrics, which runs in another process
+    registry.flush()
+
+# Not started in the pool's own workers, which import this module again if the server script does
+solver_pool = None
+if SOLVER_POOL_SIZE > 0 and multiprocessing.parent_process() is None:
+    solver_pool = SolverPool(SOLVER_POOL_SIZE, warm=POOL_WARM_CATALOGS)
+    registry.gauge('d2forge_solver_pool_queued', 'Solves waiting for a pool worker', function=solver_pool.queued)
+    registry.gauge('d2forge_solver_pool_busy', 'Pool workers solving', function=solver_pool.busy)
+
+# Popular requests solved offline (see response_pack.py); None if no current pack ships with this build
+popular_responses = load_pack()
+
+def piece_to_json(piece_type):
+    """Serialize a PieceType the way the frontend keys its pieces."""
+    return json.dumps({field: getattr(piece_type, field) for field in PIECE_FIELDS})
+
+def solution_to_json(sol, deviation, piece_stats, equivalents):
+    """Build the per-solution object the frontend renders."""
+    # Convert piece types to JSON strings for frontend consumption
+    pieces_dict = {}
+    tuning_requirements = {}
+    flexible_pieces = 0
+
+    for piece_type, count in sol.items():
+        # Convert PieceType namedtuple to dict then to JSON string
+        pieces_dict[piece_to_json(piece_type)] = count
+
+        # Track tuning requirements separately
+        if piece_type.tuning_mode == "tuned":
+            # Store as {stat: [{"count": count, "siphon_from": stat}, ...]}
+            if piece_type.tuned_stat not in tuning_requirements:
+                tuning_requirements[piece_type.tuned_stat] = []
+            tuning_requirements[piece_type.tuned_stat].append({
+                "count": count,
+                "siphon_from": piece_type.siphon_from
+            })
+            # This piece can accept flexible tuning
+            flexible_pieces += count
+        elif piece_type.tuning_mode == "none" and not is_exotic_piece(piece_type):
+            # Non-exotic, non-balanced pieces can accept any +5/-5 tuning
+            flexible_pieces += count
+
+    # Calculate actual stats achieved by this solution
+    actual_stats = calculate_actual_stats(sol, piece_stats)
+
+    # The solver works on one representative per stat vector; list the
+    # other variants that would give exactly the same stats
+    equivalent_pieces = {
+        piece_to_json(rep): [piece_to_json(v) for v in variants[1:]]
+        for rep, variants in expand_equivalents(sol, equivalents).items()
+        if len(variants) > 1
+    }
+
+    return {
+        "pieces": pieces_dict,
+        "deviation": float(deviation),
+        "actualStats": actual_stats,
+        "tuningRequirements": tuning_requirements,
+        "flexiblePieces": flexible_pieces,
+        "equivalentPieces": equivalent_pieces
+    }
+
+def builds_from_response(response):
+    """The solver builds behind a response's solutions (piece_to_json in reverse)."""
+    builds = []
+    for solution in response.get('solutions', []):
+        try:
+            builds.append({PieceType(**json.loads(piece)): count for piece, count in solution['pieces'].items()})
+        except (TypeError, ValueError, KeyError, AttributeError):
+            continue
+    return builds
+
+# The v2 view of one catalog: its document, and v1 piece descriptor -> position in it
+CatalogWire = namedtuple("CatalogWire", ["id", "href", "document", "ids"])
+
+@lru_cache(maxsize=None)
+def catalog_wire(key):
+    """CatalogWire for a catalog_key() tuple (memoized like the catalogs themselves)."""
+    allow_tuned, use_exotic, use_class_item_exotic, exotic_perks = key
+    catalog = get_piece_catalog(allow_tuned, use_exotic=use_exotic,
+                                use_class_item_exotic=use_class_item_exotic, exotic_perks=exotic_perks)
+    rows = [[getattr(p, field) for field in PIECE_FIELDS] for p in catalog.piece_types]
+    # Ids are positions, so the id changes whenever the generator's output does
+    catalog_id = hashlib.sha256(json.dumps(rows).encode('utf-8')).hexdigest()[:16]
+    query = {'allow_tuned': allow_tuned, 'use_exotic': use_exotic,
+             'use_class_item_exotic': use_class_item_exotic, 'exotic_perks': list(exotic_perks or ())}
+    href = '/api/catalog?' + urlencode({k: (str(v).lower() if isinstance(v, bool) else v) for k, v in query.items()},
+                                       doseq=True)
+    document = StaticBody({"version": 2, "id": catalog_id, "fields": list(PIECE_FIELDS), "pieces": rows})
+    ids = {piece_to_json(p): i for i, p in enumerate(catalog.piece_types)}
+    return CatalogWire(catalog_id, href, document, ids)
+
+def wire_version(path):
+    """Response version requested with ?v=N (1 if absent); raises ValueError for an unknown one."""
+    requested = parse_qs(urlsplit(path).query).get('v', ['1'])[-1]
+    if requested not in {str(v) for v in WIRE_VERSIONS}:
+        raise ValueError(f"Unsupported response version: {requested}")
+    return int(requested)
+
+def solution_to_v2(solution, wire):
+    """One v1 solution object with its pieces as [catalog id, count] pairs."""
+    ids = wire.ids
+    return dict(
+        solution,
+        pieces=[[ids[piece], count] for piece, count in solution['pieces'].items()],
+        equivalentPieces=[[ids[rep], [ids[v] for v in variants]]
+                          for rep, variants in solution['equivalentPieces'].items()]
+    )
+
+def wire_covers(response, wire):
+    """Whether every piece in a v1 response has a v2 id (one cached from an older catalog may not)."""
+    ids = wire.ids
+    for solution in response.get('solutions', []):
+        for rep, variants in solution['equivalentPieces'].items():
+            if rep not in ids or any(v not in ids for v in variants):
+                return False
+        if any(piece not in ids for piece in solution['pieces']):
+            return False
+    return True
+
+def response_to_v2(response, wire):
+    """A v1 response (as built, cached or packed) in the v2 format."""
+    v2 = dict(response, version=2, catalog={"id": wire.id, "href": wire.href})
+    v2['solutions'] = [solution_to_v2(s, wire) for s in response.get('solutions', [])]
+    return v2
+
+def result_etag(response):
+    """Validator for the builds in a response; age and timing fields don't change it."""
+    return make_etag(json.dumps([response.get('version', 1), response.get('catalog'),
+                                 response.get('solutions'), response.get('partial')], sort_keys=True), weak=True)
+
+def build_response(formatted_solutions, compute_time_seconds, partial):
+    """Wrap formatted solutions (best first) in the response body the frontend expects."""
+    if not formatted_solutions:
+        return {
+            "solutions": [],
+            "message": "No solutions found for the given stat requirements",
+            "partial": partial
+        }
+    return {
+        "solutions": formatted_solutions,
+        "message": f"Found {len(formatted_solutions)} optimal solution(s)",
+        "compute_time_seconds": compute_time_seconds,
+        "cached": False,
+        # True when the deadline stopped the search; more or better builds may exist
+        "partial": partial
+    }
+
+def catalog_options(request_data):
+    """Read and validate the catalog options; returns get_piece_catalog kwargs or raises ValueError."""
+    allow_tuned = request_data.get('allow_tuned', True)
+    use_exotic = request_data.get('use_exotic', False)
+    use_class_item_exotic = request_data.get('use_class_item_exotic', False)
+    exotic_perks = request_data.get('exotic_perks')
+
+    # Validate exotic perk combination if using exotic class item
+    exotic_perks_tuple = None
+    if use_exotic and use_class_item_exotic:
+        if not exotic_perks or len(exotic_perks) != 2:
+            raise ValueError("exotic_perks must be a list of exactly 2 perk names when using exotic class item")
+
+        # Perks may come in either order
+        exotic_perks_tuple = catalog_key(use_exotic=True, use_class_item_exotic=True, exotic_perks=exotic_perks)[3]
+        if exotic_perks_tuple not in CLASS_ITEM_ROLLS:
+            available_combinations = list(CLASS_ITEM_ROLLS.keys())
+            raise ValueError(f"Invalid exotic perk combination: {exotic_perks_tuple}. Available combinations: {available_combinations}")
+
+    return {
+        'allow_tuned': allow_tuned,
+        'use_exotic': use_exotic,
+        'use_class_item_exotic': use_class_item_exotic,
+        'exotic_perks': exotic_perks_tuple
+    }
+
+def _whole_number(value, field):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ValueError(f"{field} must be a whole number")
+    return int(value)
+
+def canonicalize_request(request_data):
+    """Reduce a request body to the fields that change the solver's result, in one canonical form.
+
+    Perks in either order, class-item flags without use_exotic, zero or null
+    minimums and minimums that every possible build already meets all map to
+    the same dict, so equivalent requests share one cache entry and one solve.
+    Raises ValueError for invalid options.
+    """
+    options = catalog_options(request_data)
+    allow_tuned, use_exotic, use_class_item_exotic, exotic_perks = catalog_key(**options)
+    canonical = {stat: _whole_number(request_data.get(stat) or 0, stat) for stat in STAT_NAMES}
+    canonical.update({
+        'allow_tuned': allow_tuned,
+        'use_exotic': use_exotic,
+        'use_class_item_exotic': use_class_item_exotic,
+        'exotic_perks': list(exotic_perks) if exotic_perks else None
+    })
+
+    raw_minimums = request_data.get('minimum_constraints') or {}
+    if not isinstance(raw_minimums, dict):
+        raise ValueError("minimum_constraints must map stat names to minimum totals")
+    minimums = {}
+    if raw_minimums:
+        bounds = stat_bounds(get_piece_catalog(**options), require_exotic=use_exotic)
+        for i, stat in enumerate(STAT_NAMES):
+            if raw_minimums.get(stat) is None:
+                continue
+            value = _whole_number(raw_minimums[stat], f"minimum_constraints.{stat}")
+            # A minimum at or below the lowest reachable total constrains nothing
+            if bounds is None or value > bounds[i][0]:
+                minimums[stat] = value
+    canonical['minimum_constraints'] = minimums or None
+    return canonical
+
+def desired_totals_from(request_data):
+    """Stat targets in STAT_NAMES order (missing stats count as 0)."""
+    return [request_data.get(stat, 0) for stat in STAT_NAMES]
+
+def stream_format(accept_header):
+    """Pick the streaming format requested by an Accept header, or None for a single JSON body."""
+    for media_type in (accept_header or '').split(','):
+        media_type = media_type.split(';')[0].strip().lower()
+        if media_type in STREAM_FORMATS:
+            return STREAM_FORMATS[media_type]
+    return None
+
+class SolutionStream:
+    """Writes events as NDJSON lines or server-sent events, flushing each one.
+
+    Headers are sent with the first event, so errors raised before anything
+    was found can still be answered with a normal status code.
+
+    Events, in order: one {"type": "solution", "index": i, "solution": {...}}
+    per build as soon as the solver accepts it, then one {"type": "summary"}
+    whose "ranking" lists the streamed indices best-first. A failure after the
+    first event ends the stream with {"type": "error"}.
+    """
+
+    def __init__(self, request_handler, fmt, cache_status=None, wire=None):
+        self.request_handler = request_handler
+        self.fmt = fmt
+        self.cache_status = cache_status
+        self.wire = wire  # CatalogWire for a v2 stream, None for v1
+        self.started = False
+        self.count = 0
+
+    def _start(self):
+        h = self.request_handler
+        h.send_response(200)
+        h.send_header('Content-Type', 'text/event-stream' if self.fmt == 'sse' else 'application/x-ndjson')
+        h.send_header('Cache-Control', 'no-cache')
+        h.send_header('X-Accel-Buffering', 'no')
+        h.send_header('Access-Control-Allow-Origin', '*')
+        h.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        h.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        if self.cache_status:
+            h.send_header('X-Cache-Status', self.cache_status)
+            h.cache_status = self.cache_status
+        # Only what happened before the first event; the log line has the rest
+        timer = getattr(h, 'timer', NULL_TIMER)
+        server_timing = timer.header()
+        if server_timing:
+            h.send_header('Server-Timing', server_timing)
+            h.send_header('Timing-Allow-Origin', '*')
+        timer.note(status=200)
+        if self.cache_status:
+            timer.note(cache=self.cache_status)
+        h.end_headers()
+        self.started = True
+
+    def send(self, event_type, payload):
+        if not self.started:
+            self._start()
+        event = {"type": event_type, **payload}
+        if self.fmt == 'sse':
+            data = f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
+        else:
+            data = json.dumps(event) + "\n"
+        self.request_handler.wfile.write(data.encode('utf-8'))
+        self.request_handler.wfile.flush()
+
+    def solution(self, solution_json):
+        if self.wire:
+            solution_json = solution_to_v2(solution_json, self.wire)
+        self.send('solution', {"index": self.count, "solution": solution_json})
+        self.count += 1
+
+    def summary(self, response, ranking):
+        summary = {k: v for k, v in response.items() if k != 'solutions'}
+        summary['ranking'] = ranking
+        if self.wire:
+            summary.update(version=2, catalog={"id": self.wire.id, "href": self.wire.href})
+        self.send('summary', summary)
+
+def run_optimization(request_data, deadline, on_solution_json=None, timer=NULL_TIMER, stats=None, priority=None):
+    """Solve one /api/optimize request body; returns (response, ranking).
+
+    on_solution_json(solution) receives each formatted solution as soon as the
+    solver accepts it; ranking lists those discovery indices best-first.
+    Stage timings are recorded on timer (see timing.py) and on stats, a
+    main.SolveStats the caller can inspect afterwards.
+    With the solver pool on, the solve queues there at priority (estimated
+    from the target if None) and PoolBusy is raised when it can't be taken.
+    Raises ValueError (including InfeasibleRequest) for a request to reject with 400.
+    """
+    start_time = time.time()
+    options = catalog_options(request_data)
+    minimum_constraints = request_data.get('minimum_constraints')
+    desired_totals = desired_totals_from(request_data)
+
+    # Piece types and their stats (shared across requests on a warm instance)
+    with timer.span('catalog'):
+        catalog = get_piece_catalog(**options)
+    piece_types, piece_stats = catalog.piece_types, catalog.piece_stats
+    equivalents = catalog.equivalents
+
+    # Sliders move in small steps, so a nearby target is often cached; its builds warm-start the solver
+    with timer.span('neighbour'):
+        neighbour = optimization_cache.nearest(request_data)
+        hints = builds_from_response(neighbour[0]) if neighbour else None
+
+    # Formatted as the solver accepts them (and passed on right away if requested)
+    found = []
+    if stats is None:
+        stats = SolveStats()
+
+    def on_solution(sol, deviation):
+        with stats.timed('format'):
+            found.append((sol, solution_to_json(sol, deviation, piece_stats, equivalents)))
+        if on_solution_json:
+            on_solution_json(found[-1][1])
+
+    if solver_pool is not None:
+        if priority is None:
+            priority = solve_priority(desired_totals, catalog, require_exotic=options['use_exotic'],
+                                      minimum_constraints=minimum_constraints)
+        remaining = deadline.remaining()
+        task = PoolTask(catalog_options=options, desired_totals=desired_totals, max_solutions=8,
+                        require_exotic=options['use_exotic'], minimum_constraints=minimum_constraints, hints=hints,
+                        expires_at=None if remaining is None else time.time() + remaining)
+        solutions_list, deviations_list, partial = solver_pool.solve(task, priority, on_solution=on_solution,
+                                                                     stats=stats)
+        if partial:
+            deadline.cut_short()
+    else:
+        solutions_list, deviations_list = solve_with_milp_multiple(
+            desired_totals,
+            piece_types,
+            piece_stats,
+            max_solutions=8,  # Slightly fewer solutions for faster computation
+            allow_tuned=options['allow_tuned'],
+            require_exotic=options['use_exotic'],
+            minimum_constraints=minimum_constraints,
+            catalog=catalog,
+            deadline=deadline,
+            on_solution=on_solution,
+            workers=SOLVER_WORKERS,
+            hints=hints,
+            stats=stats
+        )
+    timer.add_solve(stats)
+    record_solve(stats, deadline.partial)
+
+    # Discovery index of each solution, best-first
+    ranking = [next(i for i, (s, _) in enumerate(found) if s is sol) for sol in solutions_list]
+
+    # Solutions in the format expected by the frontend, best first
+    response = build_response([found[i][1] for i in ranking], round(time.time() - start_time, 2),
+                              deadline.partial)
+    return response, ranking
+
+def send_refusal(request_handler, status, retry_after, message):
+    """Turn a request away (429 rate limited, 503 shed) with a Retry-After."""
+    send_json_error(request_handler, status, message, extra_headers=[('Retry-After', str(retry_after))],
+                    retry_after_seconds=retry_after)
+
+def revalidate(request_data):
+    """Recompute a stale cache entry off the request path and store the fresh response.
+
+    The caller holds the entry's begin_revalidation() claim; it is released
+    here however the refresh ends.
+    """
+    # Only on an idle solve slot, or behind every request in the solver pool; otherwise a later stale hit tries again
+    slot = None
+    try:
+        if solver_pool is None:
+            slot = solve_slots.acquire(timeout=0)
+            if slot is None:
+                return
+        deadline = Deadline(REQUEST_TIMEOUT_SECONDS)
+        try:
+            response, _ = run_optimization(request_data, deadline, priority=PRIORITY_BACKGROUND)
+        finally:
+            if slot is not None:
+                solve_slots.release(slot)
+        if not deadline.partial:
+            optimization_cache.set(request_data, response)
+    except Exception:
+        pass
+    finally:
+        optimization_cache.end_revalidation(request_data)
+
+def refresh_stale(request_data, cached):
+    """Start refreshing a stale cache hit in the background, unless a request already is."""
+    if cached.stale and optimization_cache.begin_revalidation(request_data):
+        threading.Thread(target=revalidate, args=(request_data,), daemon=True).start()
 
 class handler(BaseHTTPRequestHandler):
+    wire = None  # CatalogWire when the request asked for ?v=2
+    timer = NULL_TIMER
+    status = None  # as sent, for metrics
+    cache_status = None
+
     def do_POST(self):
         start_time = time.time()
+        timer = self.timer = request_timer('optimize')
+        # One hard budget for the whole request: catalog, pre-screen, both solver phases and formatting
+        # Most users get good results within 15 seconds
+        deadline = Deadline(REQUEST_TIMEOUT_SECONDS)
+        stream = None
         try:
             # Get client IP for rate limiting
             client_ip = self.headers.get('X-Forwarded-For', self.client_address[0]).split(',')[0].strip()
             
-            # Check rate limit
-            is_allowed, retry_after = rate_limiter.is_allowed(client_ip)
-            if not is_allowed:
-                self.send_response(429)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Retry-After', str(retry_after))
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                error_response = {
-                    "error": "Rate limit exceeded. Please wait before making another request.",
-                    "retry_after_seconds": retry_after
-                }
-                self.wfile.write(json.dumps(error_response).encode('utf-8'))
-                return
-            
             # Read request body first
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            request_data = json.loads(post_data.decode('utf-8'))
+            with timer.span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                request_data = json.loads(post_data.decode('utf-8'))
+
+                # Equivalent requests share one cache entry and one solve
+                try:
+                    request_data = canonicalize_request(request_data)
+                    if wire_version(self.path) == 2:
+                        self.wire = catalog_wire(catalog_key(**catalog_options(request_data)))
+                except ValueError as e:
+                    send_json_error(self, 400, str(e))
+                    return
+            cache_key = optimization_cache.key_for(request_data)
+            timer.note(cache_key=cache_key)
+
+            # Opt-in streaming: each solution is written as soon as it is found
+            fmt = stream_format(self.headers.get('Accept'))
             
+            # Precomputed popular builds never expire, so they are checked before the TTL cache
+            if popular_responses:
+                with timer.span('pack'):
+                    packed = popular_responses.get(cache_key)
+                if packed and self.encodable(packed):
+                    self.send_cached(CachedResponse(packed, popular_responses.created_at, False), fmt, 'PACK')
+                    return
+
             # Try to get cached response first
-            cached_response = optimization_cache.get(request_data)
-            if cached_response:
-                # Return cached response immediately  
-                response = cached_response.get('response', cached_response)
-                response['cached'] = True
-                response['cache_age_seconds'] = int(time.time() - cached_response.get('cached_at', time.time()))
-                
-                # Send cache hit response
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                self.send_header('X-Cache-Status', 'HIT')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode('utf-8'))
+            with timer.span('cache'):
+                cached = self.lookup_cache(request_data)
+            if cached:
+                # Serve a stale copy now; one request per key refreshes it in the background
+                refresh_stale(request_data, cached)
+                self.send_cached(cached, fmt)
                 return
-            
-            # Set CORS headers for cache miss
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            self.send_header('X-Cache-Status', 'MISS')
-            self.end_headers()
-            
-            # Extract parameters with defaults
-            allow_tuned = request_data.get('allow_tuned', True)
-            use_exotic = request_data.get('use_exotic', False)
-            use_class_item_exotic = request_data.get('use_class_item_exotic', False)
-            exotic_perks = request_data.get('exotic_perks')
-            minimum_constraints = request_data.get('minimum_constraints')
-            
-            # Convert to desired totals array
-            desired_totals = [
-                request_data.get('Health', 0),
-                request_data.get('Melee', 0),
-                request_data.get('Grenade', 0),
-                request_data.get('Super', 0),
-                request_data.get('Class', 0),
-                request_data.get('Weapons', 0)
-            ]
-            
-            # Validate exotic perk combination if using exotic class item
-            exotic_perks_tuple = None
-            if use_exotic and use_class_item_exotic:
-                if not exotic_perks or len(exotic_perks) != 2:
-                    self.send_error(400, "exotic_perks must be a list of exactly 2 perk names when using exotic class item")
+
+            # Identical requests already being solved (by a thread here or a process on this host) are joined
+            flight, leader = optimize_flights.begin(cache_key, timeout=(deadline.remaining() or 0) / 2)
+            if not leader:
+                if fmt:
+                    stream = SolutionStream(self, fmt, 'COALESCED', self.wire)
+                    for solution_json in flight.follow(deadline.remaining()):
+                        stream.solution(solution_json)
+                    if flight.result is not None:
+                        stream.summary(*flight.result)
+                        return
+                    if stream.started:
+                        stream.send('error', {"error": "Optimization failed: the shared solve did not finish"})
+                        return
+                else:
+                    with timer.span('coalesced'):
+                        result = flight.wait(deadline.remaining())
+                    if result is not None:
+                        self.send_json(result[0], 'COALESCED')
+                        return
+                # The leader failed or ran out of time: solve it here instead
+                stream = None
+            else:
+                # Another process may have finished it while this one waited for the host lock
+                cached = self.lookup_cache(request_data, count=False)
+                if cached:
+                    response = json.loads(cached.body)
+                    optimize_flights.end(cache_key, flight, (response, list(range(len(response['solutions'])))))
+                    self.send_cached(cached, fmt)
                     return
-                
-                exotic_perks_tuple = tuple(exotic_perks)
-                if exotic_perks_tuple not in CLASS_ITEM_ROLLS:
-                    available_combinations = list(CLASS_ITEM_ROLLS.keys())
-                    error_msg = f"Invalid exotic perk combination: {exotic_perks_tuple}. Available combinations: {available_combinations}"
-                    self.send_error(400, error_msg)
+
+            # Only solves count against the rate limit; cache hits and coalesced answers are free
+            is_allowed, retry_after = rate_limiter.is_allowed(client_ip, COST_EXACT)
+            if not is_allowed:
+                if leader:
+                    optimize_flights.end(cache_key, flight, None)
+                send_refusal(self, 429, retry_after, "Rate limit exceeded. Please wait before making another request.")
+                return
+
+            # Solves queue for one of the host's solve slots, so a burst can't oversubscribe the CPU
+            # (the solver pool, when on, queues them itself by priority)
+            slot = None
+            if solver_pool is None:
+                with timer.span('queue'):
+                    slot = solve_slots.acquire(timeout=(deadline.remaining() or 0) * MAX_QUEUE_SHARE)
+                if slot is None:
+                    if leader:
+                        optimize_flights.end(cache_key, flight, None)
+                    self.shed(client_ip)
                     return
+
+            if fmt:
+                stream = SolutionStream(self, fmt, 'MISS', self.wire)
+
+            def on_solution_json(solution_json):
+                if leader:
+                    flight.publish(solution_json)
+                if stream:
+                    stream.solution(solution_json)
+
+            # Run optimization against the request deadline
+            result = None
+            stats = SolveStats()
+            try:
+                response, ranking = run_optimization(request_data, deadline, on_solution_json=on_solution_json,
+                                                     timer=timer, stats=stats)
+                result = (response, ranking)
+                timer.note(partial=deadline.partial, solutions=len(response['solutions']))
+            except ValueError as e:
+                # Invalid options, or rejected by the pre-screen before any solver ran
+                send_json_error(self, 400, str(e))
+                return
+            except PoolBusy:
+                self.shed(client_ip)
+                return
+            finally:
+                if slot is not None:
+                    solve_slots.release(slot)
+                if leader:
+                    optimize_flights.end(cache_key, flight, result)
+                # A solve that fell through to approximations costs more than was admitted
+                rate_limiter.charge(client_ip, solve_cost(stats) - COST_EXACT)
             
-            # Generate piece types and their stats
-            piece_types, piece_stats = generate_piece_types(
-                allow_tuned=allow_tuned,
-                use_exotic=use_exotic,
-                use_class_item_exotic=use_class_item_exotic,
-                exotic_perks=exotic_perks_tuple
-            )
-            
-            # Run optimization with reduced timeout for better resource efficiency
-            # Most users get good results within 15 seconds
-            solutions_list, deviations_list = solve_with_milp_multiple(
-                desired_totals, 
-                piece_types, 
-                piece_stats, 
-                max_solutions=8,  # Slightly fewer solutions for faster computation
-                allow_tuned=allow_tuned,
-                require_exotic=use_exotic,
-                total_timeout=15,  # Reduced from 30 to 15 seconds
-                minimum_constraints=minimum_constraints
-            )
-            
-            if not solutions_list:
-                response = {
-                    "solutions": [],
-                    "message": "No solutions found for the given stat requirements"
-                }
-            else:
-                # Convert solutions to the format expected by the frontend
-                formatted_solutions = []
-                for sol, deviation in zip(solutions_list, deviations_list):
-                    # Convert piece types to JSON strings for frontend consumption
-                    pieces_dict = {}
-                    tuning_requirements = {}
-                    flexible_pieces = 0
-                    
-                    for piece_type, count in sol.items():
-                        # Convert PieceType namedtuple to dict then to JSON string
-                        piece_dict = {
-                            'arch': piece_type.arch,
-                            'tertiary': piece_type.tertiary,
-                            'tuning_mode': piece_type.tuning_mode,
-                            'mod_target': piece_type.mod_target,
-                            'tuned_stat': piece_type.tuned_stat,
-                            'siphon_from': piece_type.siphon_from
-                        }
-                        pieces_dict[json.dumps(piece_dict)] = count
-                        
-                        # Track tuning requirements separately
-                        if piece_type.tuning_mode == "tuned":
-                            # Store as {stat: [{"count": count, "siphon_from": stat}, ...]}
-                            if piece_type.tuned_stat not in tuning_requirements:
-                                tuning_requirements[piece_type.tuned_stat] = []
-                            tuning_requirements[piece_type.tuned_stat].append({
-                                "count": count,
-                                "siphon_from": piece_type.siphon_from
-                            })
-                            # This piece can accept flexible tuning
-                            flexible_pieces += count
-                        elif piece_type.tuning_mode == "none" and not str(piece_type.arch).lower().startswith("exotic "):
-                            # Non-exotic, non-balanced pieces can accept any +5/-5 tuning
-                            flexible_pieces += count
-                    
-                    # Calculate actual stats achieved by this solution
-                    actual_stats = calculate_actual_stats(sol, piece_stats)
-                    
-                    formatted_solutions.append({
-                        "pieces": pieces_dict,
-                        "deviation": float(deviation),
-                        "actualStats": actual_stats,
-                        "tuningRequirements": tuning_requirements,
-                        "flexiblePieces": flexible_pieces
-                    })
-                
-                response = {
-                    "solutions": formatted_solutions,
-                    "message": f"Found {len(formatted_solutions)} optimal solution(s)",
-                    "compute_time_seconds": round(time.time() - start_time, 2),
-                    "cached": False
-                }
-            
-            # Cache the response for future requests
-            optimization_cache.set(request_data, response)
-            
-            # Periodic cleanup to prevent memory leaks (every ~100 requests)
-            if int(start_time) % 100 == 0:
-                rate_limiter.cleanup_old_entries()
+            # Cache the response for future requests (a partial one could hide better builds)
+            if not deadline.partial:
+                with timer.span('cache_store'):
+                    optimization_cache.set(request_data, response)
+
+            if stream:
+                stream.summary(response, ranking)
+                return
             
-            # Send response
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+            # Headers go out only once the solve succeeded, so errors above can still set the status
+            self.send_json(response, 'MISS')
             
         except Exception as e:
-            self.send_error(500, f"Optimization failed: {str(e)}")
-    
+            if stream and stream.started:
+                # Status line already sent; end the stream with an error event instead
+                stream.send('error', {"error": f"Optimization failed: {str(e)}"})
+                return
+            send_json_error(self, 500, f"Optimization failed: {str(e)}")
+        finally:
+            timer.log()
+            record_request('optimize', self, time.time() - start_time)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def send_error(self, code, message=None, explain=None):
+        self.timer.note(status=code)
+        super().send_error(code, message, explain)
+
+    def shed(self, client_ip):
+        """Refuse an admitted solve the server has no capacity for, and give back its token."""
+        rate_limiter.refund(client_ip, COST_EXACT)
+        send_refusal(self, 503, SHED_RETRY_AFTER_SECONDS, "Server busy. Please try again shortly.")
+
+    def encodable(self, body):
+        """Whether a serialized v1 response can be sent in the requested version."""
+        return not self.wire or wire_covers(json.loads(body), self.wire)
+
+    def lookup_cache(self, request_data, count=True):
+        """optimization_cache.lookup(), except that an entry v2 can't encode is dropped and missed."""
+        cached = optimization_cache.lookup(request_data, count=count)
+        if cached and not self.encodable(cached.body):
+            optimization_cache.invalidate(request_data)
+            return None
+        return cached
+
+    def send_json(self, response, cache_status):
+        """Send a response dict, or its serialized v1 form, in the requested version.
+
+        Its ETag covers the builds only, so a client can tell whether they changed.
+        """
+        body = None
+        with self.timer.span('serialize'):
+            if isinstance(response, bytes):
+                body, response = response, json.loads(response)
+            if self.wire:
+                response, body = response_to_v2(response, self.wire), None
+            if body is None:
+                body = json.dumps(response).encode('utf-8')
+            etag = result_etag(response)
+        headers = [('X-Cache-Status', cache_status)]
+        server_timing = self.timer.header()
+        if server_timing:
+            headers += [('Server-Timing', server_timing), ('Timing-Allow-Origin', '*')]
+        self.cache_status = cache_status
+        status = send_body(self, body, etag, RESULT_CACHE_CONTROL, methods='POST, OPTIONS', extra_headers=headers)
+        self.timer.note(status=status, cache=cache_status)
+
+    def send_cached(self, cached, fmt, cache_status=None):
+        """Answer from a cache hit, as a stream if one was requested."""
+        cache_status = cache_status or ('STALE' if cached.stale else 'HIT')
+        if fmt:
+            response = json.loads(cached.body)
+            stream = SolutionStream(self, fmt, cache_status, self.wire)
+            for solution_json in response.get('solutions', []):
+                stream.solution(solution_json)
+            stream.summary(response, list(range(stream.count)))
+            return
+        # Already serialized
+        self.send_json(cached.body, cache_status)
+
     def do_OPTIONS(self):
         # Handle CORS preflight
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
\ No newline at end of file
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
+        self.end_headers()
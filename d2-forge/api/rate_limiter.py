@@ -1,55 +1,187 @@
+import math
+import os
+import threading
 import time
-from collections import defaultdict, deque
-
-class SimpleRateLimiter:
-    """Simple in-memory rate limiter to prevent API abuse."""
-    
-    def __init__(self, max_requests=5, window_seconds=60):
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.requests = defaultdict(deque)  # IP -> deque of timestamps
-    
-    def is_allowed(self, client_ip: str) -> tuple[bool, int]:
+from collections import OrderedDict
+
+from metrics_registry import registry
+
+# Cross-process solve slots need POSIX advisory locks; without them the budget is per process
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# Tokens a solve costs, by the work it turned out to need (cache hits are free: they never reach the limiter)
+COST_EXACT = 1  # charged when a solve is admitted
+COST_APPROXIMATE = 4  # total for a solve that fell through to approximations (phase 2)
+
+RATE_LIMIT_DECISIONS = registry.counter('d2forge_rate_limit_decisions_total',
+                                        'Rate limiter decisions, by result (allowed, rejected)', ['result'])
+RATE_LIMIT_TOKENS = registry.counter('d2forge_rate_limit_tokens_charged_total', 'Tokens charged to clients')
+SOLVE_SLOT_WAIT_SECONDS = registry.histogram('d2forge_solve_slot_wait_seconds',
+                                             'Time solves queued for a solve slot')
+SOLVES_SHED = registry.counter('d2forge_solves_shed_total', 'Solves refused because no solve slot freed up in time')
+
+class TokenBucketLimiter:
+    """Per-IP token buckets, charged by what a request costs.
+
+    A client's bucket holds up to capacity tokens and refills at
+    refill_per_second. A solve is admitted while the bucket holds its
+    up-front cost; whatever more it turns out to cost is charged afterwards
+    with charge(), which can leave the bucket in debt until it refills.
+    Cache hits never touch the limiter.
+
+    Buckets are kept in least-recently-used order. A bucket that has refilled
+    to capacity is the same as no bucket, so full ones are dropped from the
+    old end on every update (O(1) amortized), and at most max_clients are
+    kept.
+    """
+
+    def __init__(self, capacity=12, refill_per_second=12 / 60, max_clients=10000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # IP -> (tokens, updated_at), least recently used first
+
+    def _take(self, client_ip, now):
+        """Remove and return this client's current token count (caller holds the lock)."""
+        entry = self._buckets.pop(client_ip, None)
+        if entry is None:
+            return self.capacity
+        tokens, updated_at = entry
+        return min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+
+    def _put(self, client_ip, tokens, now):
+        """Store a client's tokens as most recently used and drop expired buckets (caller holds the lock)."""
+        self._buckets[client_ip] = (tokens, now)
+        while len(self._buckets) > 1:
+            tokens, updated_at = next(iter(self._buckets.values()))
+            if (len(self._buckets) <= self.max_clients
+                    and tokens + (now - updated_at) * self.refill_per_second < self.capacity):
+                break
+            self._buckets.popitem(last=False)
+
+    def is_allowed(self, client_ip: str, cost: float = COST_EXACT) -> tuple[bool, int]:
         """
-        Check if request is allowed for this IP.
+        Charge cost if the client's bucket holds it.
         Returns (is_allowed, retry_after_seconds)
         """
         now = time.time()
-        ip_requests = self.requests[client_ip]
-        
-        # Remove old requests outside the window
-        while ip_requests and ip_requests[0] < now - self.window_seconds:
-            ip_requests.popleft()
-        
-        # Check if under limit
-        if len(ip_requests) < self.max_requests:
-            ip_requests.append(now)
-            return True, 0
-        
-        # Calculate retry after time
-        oldest_request = ip_requests[0]
-        retry_after = int(oldest_request + self.window_seconds - now) + 1
-        return False, retry_after
-    
-    def cleanup_old_entries(self):
-        """Clean up old entries to prevent memory leaks."""
+        with self._lock:
+            tokens = self._take(client_ip, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._put(client_ip, tokens, now)
+        if not allowed:
+            RATE_LIMIT_DECISIONS.inc(result='rejected')
+            return False, max(1, math.ceil((cost - tokens) / self.refill_per_second))
+        RATE_LIMIT_DECISIONS.inc(result='allowed')
+        RATE_LIMIT_TOKENS.inc(cost)
+        return True, 0
+
+    def charge(self, client_ip: str, cost: float):
+        """Charge work found to cost more than was admitted; the bucket may go into debt."""
+        if cost <= 0:
+            return
         now = time.time()
-        cutoff = now - self.window_seconds * 2  # Keep extra buffer
-        
-        to_remove = []
-        for ip, requests in self.requests.items():
-            # Remove old requests
-            while requests and requests[0] < cutoff:
-                requests.popleft()
-            
-            # Mark empty queues for removal
-            if not requests:
-                to_remove.append(ip)
-        
-        # Remove empty entries
-        for ip in to_remove:
-            del self.requests[ip]
+        with self._lock:
+            self._put(client_ip, self._take(client_ip, now) - cost, now)
+        RATE_LIMIT_TOKENS.inc(cost)
+
+    def take_up_to(self, client_ip: str, cost: float) -> float:
+        """Charge as much of cost as the bucket holds (nothing if it is empty or in debt); returns what was charged."""
+        now = time.time()
+        with self._lock:
+            tokens = self._take(client_ip, now)
+            taken = min(cost, max(0.0, tokens))
+            self._put(client_ip, tokens - taken, now)
+        if taken > 0:
+            RATE_LIMIT_TOKENS.inc(taken)
+        return taken
+
+    def refund(self, client_ip: str, cost: float):
+        """Give back tokens charged for work that was never done."""
+        now = time.time()
+        with self._lock:
+            self._put(client_ip, min(self.capacity, self._take(client_ip, now) + cost), now)
+
+    def tracked_clients(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+
+class SolveSlots:
+    """Host-wide cap on concurrent solves, so a burst queues instead of thrashing the CPU.
+
+    A solve holds one of `slots` flock()ed slot files under lock_dir while it
+    runs; threads and processes on the host compete for the same files.
+    acquire() waits up to its timeout for a free one and returns None after
+    that, so the caller can shed the request. Without fcntl the cap is kept
+    per process with a semaphore.
+    """
+
+    def __init__(self, slots, lock_dir="/tmp/d2forge_locks"):
+        self.slots = max(1, slots)
+        self.lock_dir = lock_dir
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        if HAS_FCNTL:
+            try:
+                os.makedirs(self.lock_dir, exist_ok=True)
+            except OSError:
+                self.lock_dir = None
+
+    def _try_slot_files(self):
+        for i in range(self.slots):
+            try:
+                slot_file = open(os.path.join(self.lock_dir, f"solve-slot-{i:02d}.lock"), "a+")
+            except OSError:
+                # Unusable lock directory: fall back to the per-process semaphore
+                self.lock_dir = None
+                return None
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot_file
+            except OSError:
+                slot_file.close()
+        return None
+
+    def acquire(self, timeout):
+        """A slot to pass to release(), or None if none freed up within timeout seconds."""
+        start = time.monotonic()
+        while True:
+            if not HAS_FCNTL or not self.lock_dir:
+                remaining = max(0.0, timeout - (time.monotonic() - start))
+                slot = True if self._semaphore.acquire(timeout=remaining) else None
+                break
+            slot = self._try_slot_files()
+            if slot is not None or time.monotonic() - start >= timeout:
+                break
+            time.sleep(0.05)
+        if slot is None:
+            SOLVES_SHED.inc()
+        else:
+            SOLVE_SLOT_WAIT_SECONDS.observe(time.monotonic() - start)
+        return slot
+
+    def release(self, slot):
+        if slot is True:
+            self._semaphore.release()
+            return
+        try:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+        finally:
+            slot.close()
 
 # Global rate limiter
-# Allow 4 requests per minute per IP (with optimization timeout of 15s, this is reasonable)
-rate_limiter = SimpleRateLimiter(max_requests=4, window_seconds=60)
\ No newline at end of file
+# A client can start 12 exact solves, or 3 that fall through to approximations, per minute
+# (with optimization timeout of 15s, this is reasonable); cache hits are free
+rate_limiter = TokenBucketLimiter(capacity=12, refill_per_second=12 / 60)
+registry.gauge('d2forge_rate_limit_tracked_ips', 'Client IPs the rate limiters are tracking',
+               function=rate_limiter.tracked_clients)
+
+# One solve per core by default; with SOLVER_WORKERS > 1 each solve uses several, so lower it to match
+solve_slots = SolveSlots(int(os.environ.get('SOLVE_SLOTS', os.cpu_count() or 1)))
@@ -0,0 +1,146 @@
+"""
+Precomputed responses for popular requests, loaded read-only at cold start.
+
+Responses are deterministic for a given SOLVER_VERSION, armor constants and
+CLASS_ITEM_ROLLS, so the most common requests can be solved offline and
+shipped with the function:
+
+    python api/response_pack.py [requests.ndjson more.json ...] [--limit 500]
+
+Each input file holds request bodies (a JSON array, or one JSON object per
+line, e.g. exported request logs); without any, the curated
+api/data/popular_requests.json is used. Bodies are canonicalized like
+/api/optimize does, counted, and the most frequent ones are solved and
+written to api/data/response_pack.json.gz, which is committed. /api/optimize
+answers from the pack before looking at its TTL cache. A pack built by
+another solver version or from different constants is ignored.
+"""
+
+from collections import Counter
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+from exact_index import index_fingerprint
+from exotic_class_items import CLASS_ITEM_ROLLS
+from main import SOLVER_VERSION
+
+PACK_VERSION = 1
+DEFAULT_PACK_PATH = os.path.join(os.path.dirname(__file__), "data", "response_pack.json.gz")
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "popular_requests.json")
+# Solve budget per request when building (offline, so more than a live request gets)
+BUILD_TIMEOUT_SECONDS = 60
+
+
+def pack_fingerprint():
+    """Hash of everything a response depends on; a mismatch marks the pack stale."""
+    rolls = {" + ".join(perks): list(stats) for perks, stats in CLASS_ITEM_ROLLS.items()}
+    data = json.dumps({"version": PACK_VERSION, "solver": SOLVER_VERSION, "constants": index_fingerprint(),
+                       "class_items": rolls}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponsePack:
+    """Read-only cache key -> serialized response, as served on a hit."""
+
+    def __init__(self, entries, created_at):
+        self.created_at = created_at
+        self._bodies = {key: json.dumps(dict(response, cached=True)).encode('utf-8')
+                        for key, response in entries.items()}
+
+    def get(self, cache_key):
+        return self._bodies.get(cache_key)
+
+    def __len__(self):
+        return len(self._bodies)
+
+
+def load_pack(path=DEFAULT_PACK_PATH):
+    """The pack at path, or None if it is missing, unreadable or was built from other constants."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != PACK_VERSION or data.get("fingerprint") != pack_fingerprint():
+        return None
+    return ResponsePack(data["entries"], data.get("created_at"))
+
+
+def write_pack(path, entries):
+    """Write entries (cache key -> response) atomically."""
+    data = {
+        "version": PACK_VERSION,
+        "fingerprint": pack_fingerprint(),
+        "created_at": time.time(),
+        "entries": entries,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"), sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def read_corpus(paths):
+    """Request bodies from JSON-array or one-object-per-line files."""
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            yield from json.loads(text)
+        else:
+            for line in text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+# ----------------------------
+# Build step
+# ----------------------------
+if __name__ == "__main__":
+    import argparse
+
+    from cache import optimization_cache
+    from main import Deadline
+    from optimize import canonicalize_request, run_optimization
+
+    parser = argparse.ArgumentParser(description="Solve the most common requests into a response pack")
+    parser.add_argument("corpus", nargs="*", default=[DEFAULT_CORPUS_PATH],
+                        help="request bodies (JSON array or NDJSON); default: data/popular_requests.json")
+    parser.add_argument("--limit", type=int, default=500, help="how many distinct requests to keep")
+    parser.add_argument("--output", default=DEFAULT_PACK_PATH)
+    args = parser.parse_args()
+
+    counts = Counter()
+    canonical = {}
+    skipped = 0
+    for body in read_corpus(args.corpus):
+        try:
+            request = canonicalize_request(body)
+        except (ValueError, AttributeError):
+            skipped += 1
+            continue
+        key = optimization_cache.key_for(request)
+        canonical[key] = request
+        counts[key] += 1
+
+    entries = {}
+    for key, count in counts.most_common(args.limit):
+        deadline = Deadline(BUILD_TIMEOUT_SECONDS)
+        try:
+            response, _ = run_optimization(canonical[key], deadline)
+        except ValueError:
+            continue  # rejected requests are answered quickly anyway
+        if deadline.partial:
+            print(f"skipping {key[:12]} (hit the {BUILD_TIMEOUT_SECONDS}s limit)", file=sys.stderr)
+            continue
+        response.pop("compute_time_seconds", None)
+        entries[key] = response
+
+    write_pack(args.output, entries)
+    print(f"Wrote {args.output}: {len(entries)} responses from {sum(counts.values())} requests "
+          f"({len(counts)} distinct, {skipped} invalid)")
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+import time
+
+# Cross-process coordination needs POSIX advisory locks; without them only threads are coalesced
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+
+class Flight:
+    """One in-progress computation that identical requests can wait on or follow."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.events = []  # results published so far, in order
+        self.done = False
+        self.result = None  # None if the leader failed
+        self.lock_file = None
+        self.lock_path = None
+
+    def publish(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self, result):
+        with self._cond:
+            self.result = result
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until the leader finishes; returns its result, or None on failure or timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done, timeout)
+            return self.result
+
+    def follow(self, timeout=None):
+        """Yield every published event, past and future, until the leader finishes or the timeout passes."""
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        seen = 0
+        while True:
+            with self._cond:
+                while seen == len(self.events) and not self.done:
+                    remaining = None if expires_at is None else expires_at - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+                pending = self.events[seen:]
+                seen = len(self.events)
+                done = self.done
+            for event in pending:
+                yield event
+            if done:
+                return
+
+
+class SingleFlight:
+    """Coalesces identical concurrent work: the first caller for a key leads, the rest wait on it.
+
+    Threads share Flight objects through an in-process registry. Processes on
+    the same host are serialized per key through a flock()ed lock file of
+    their own, so unrelated keys never wait on each other; the leader removes
+    it in end(). A process that had to wait should re-check its cache before
+    doing the work itself.
+    """
+
+    def __init__(self, lock_dir="/tmp/d2forge_locks"):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._flights = {}
+        if HAS_FCNTL:
+            try:
+                os.makedirs(self.lock_dir, exist_ok=True)
+            except OSError:
+                self.lock_dir = None
+
+    def begin(self, key, timeout=None):
+        """Returns (flight, is_leader). A leader must call end() when done, even on failure."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+        flight.lock_path = self._lock_path(key)
+        flight.lock_file = self._acquire_host_lock(flight.lock_path, timeout)
+        return flight, True
+
+    def end(self, key, flight, result):
+        """Publish the leader's result (None on failure) and release the key."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result)
+        if flight.lock_file is not None:
+            try:
+                # Removed while still locked, so the next process to lock this key makes a fresh file
+                os.remove(flight.lock_path)
+            except OSError:
+                pass
+            try:
+                fcntl.flock(flight.lock_file, fcntl.LOCK_UN)
+            finally:
+                flight.lock_file.close()
+                flight.lock_file = None
+
+    def _lock_path(self, key):
+        if not HAS_FCNTL or not self.lock_dir:
+            return None
+        return os.path.join(self.lock_dir, f"flight-{hashlib.sha256(key.encode()).hexdigest()}.lock")
+
+    def _acquire_host_lock(self, lock_path, timeout):
+        """Hold a key's lock file across processes; waits (up to timeout) while another process has it."""
+        if lock_path is None:
+            return None
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                lock_file = open(lock_path, "a+")
+            except OSError:
+                return None
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if expires_at is not None and time.monotonic() >= expires_at:
+                        # Give up waiting and do the work unlocked rather than miss the deadline
+                        lock_file.close()
+                        return None
+                    time.sleep(0.05)
+                except OSError:
+                    lock_file.close()
+                    return None
+            # The previous holder may have removed the file while this one waited on it
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except OSError:
+                pass
+            lock_file.close()
+
+# Global coalescing registry for /api/optimize cache misses
+optimize_flights = SingleFlight()
@@ -0,0 +1,273 @@
+"""
+Pre-warmed solver processes with a priority queue in front, for servers that
+answer many requests from one process (see SOLVER_POOL_SIZE in optimize.py).
+
+A fixed number of worker processes start once. Each loads pulp and builds
+the warm catalogs (with their exact-match indexes) before taking work, then
+solves one request at a time, so a burst queues instead of oversubscribing
+the CPU. Queued solves are taken most urgent first, in arrival order within
+a priority: targets that may have an exact match, then those that can only
+be approximated, then background revalidations.
+
+solve() raises PoolBusy when max_queue solves are already waiting, and when
+its deadline passes before a worker is free; the caller never waits past the
+deadline for a queued solve.
+"""
+
+from collections import namedtuple
+import heapq
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+
+from main import Deadline, SolveStats, get_piece_catalog, prescreen, solve_with_milp_multiple, _load_pulp
+from exact_solver import get_exact_index
+from metrics_registry import registry
+
+PRIORITY_EXACT = 0
+PRIORITY_APPROXIMATE = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("exact", "approximate", "background")
+
+# Seconds before a crashed worker is started again
+RESTART_DELAY_SECONDS = 1.0
+# How long past its deadline a running solve may take to report back (CBC can overrun its time limit slightly)
+RESULT_GRACE_SECONDS = 2.0
+
+POOL_QUEUE_SECONDS = registry.histogram('d2forge_solver_pool_queue_seconds',
+                                        'Time solves waited for a pool worker, by priority', ['priority'])
+POOL_REJECTED = registry.counter('d2forge_solver_pool_rejected_total',
+                                 'Solves the pool turned away, by reason (queue_full, expired)', ['reason'])
+
+# One solve sent to a worker process
+PoolTask = namedtuple(
+    "PoolTask",
+    [
+        "catalog_options",  # get_piece_catalog kwargs
+        "desired_totals",
+        "max_solutions",
+        "require_exotic",
+        "minimum_constraints",
+        "hints",  # builds to warm-start from, or None
+        "expires_at",  # time.time() when the solve must be done (it may queue first), or None
+    ],
+)
+
+
+class PoolBusy(Exception):
+    """No pool worker will take this solve in time; the request should be shed."""
+
+
+def solve_priority(desired_totals, catalog, require_exotic=False, minimum_constraints=None):
+    """PRIORITY_EXACT when an exact match may exist, else PRIORITY_APPROXIMATE.
+
+    Uses the pre-screen, so it raises InfeasibleRequest for requests no solver could answer.
+    """
+    reason = prescreen(desired_totals, catalog, require_exotic=require_exotic,
+                       minimum_constraints=minimum_constraints)
+    return PRIORITY_EXACT if reason is None else PRIORITY_APPROXIMATE
+
+
+def _worker_main(conn, warm):
+    """Worker process entry point: warm up, then solve tasks from conn until it sends None.
+
+    Sends ("solution", build, deviation) per accepted build, then
+    ("done", ranking, deviations, partial, stats) with ranking as discovery
+    indices best-first, or ("error", exception).
+    """
+    _load_pulp()
+    for options in warm:
+        get_exact_index(get_piece_catalog(**options))
+    conn.send(("ready",))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        stats = SolveStats()
+        deadline = Deadline(None if task.expires_at is None else max(0.0, task.expires_at - time.time()))
+        found = []
+
+        def on_solution(sol, deviation):
+            found.append(sol)
+            conn.send(("solution", sol, deviation))
+
+        try:
+            catalog = get_piece_catalog(**task.catalog_options)
+            solutions, deviations = solve_with_milp_multiple(
+                task.desired_totals, catalog.piece_types, catalog.piece_stats,
+                max_solutions=task.max_solutions,
+                allow_tuned=task.catalog_options['allow_tuned'],
+                require_exotic=task.require_exotic,
+                minimum_constraints=task.minimum_constraints,
+                catalog=catalog,
+                deadline=deadline,
+                on_solution=on_solution,
+                hints=task.hints,
+                stats=stats,
+            )
+        except Exception as e:
+            conn.send(("error", e))
+            continue
+        ranking = [next(i for i, s in enumerate(found) if s is sol) for sol in solutions]
+        conn.send(("done", ranking, deviations, deadline.partial, stats))
+
+
+class _Job:
+    def __init__(self, task, priority):
+        self.task = task
+        self.priority = priority
+        self.submitted = time.monotonic()
+        self.messages = queue.Queue()  # worker messages, relayed to the thread waiting in solve()
+
+
+class SolverPool:
+    """size pre-warmed worker processes fed from one priority queue.
+
+    Each worker has a feeder thread here that hands it the most urgent queued
+    job and relays the worker's messages back; a worker that dies is started
+    again. Workers are spawned (not forked), so they never inherit locks held
+    by the server's threads.
+    """
+
+    def __init__(self, size, warm=(), max_queue=None):
+        self.size = size
+        self.warm = list(warm)
+        self.max_queue = 4 * size if max_queue is None else max_queue
+        self._context = multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, arrival number, job)
+        self._arrivals = itertools.count()
+        self._busy = 0
+        for i in range(size):
+            threading.Thread(target=self._feed, name=f"solver-pool-{i}", daemon=True).start()
+
+    def queued(self):
+        with self._cond:
+            return len(self._queue)
+
+    def busy(self):
+        with self._cond:
+            return self._busy
+
+    def solve(self, task, priority, on_solution=None, stats=None):
+        """Run task on a worker; returns (solutions, deviations, partial) like solve_with_milp_multiple.
+
+        Blocks while the task is queued. on_solution(sol, deviation) is called
+        on this thread as builds arrive, with the same objects that are
+        returned. The worker's stage timings (and the time spent queued, as
+        "queue") are added to stats. Raises PoolBusy, or whatever the solve raised.
+        A worker that doesn't report back in time leaves the builds it sent so
+        far, unranked and partial.
+        """
+        job = _Job(task, priority)
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                POOL_REJECTED.inc(reason='queue_full')
+                raise PoolBusy(f"{len(self._queue)} solves already queued")
+            heapq.heappush(self._queue, (priority, next(self._arrivals), job))
+            self._cond.notify()
+
+        found, deviations = [], []
+        started = False
+        while True:
+            timeout = None
+            if task.expires_at is not None:
+                timeout = max(0.0, task.expires_at - time.time()) + (RESULT_GRACE_SECONDS if started else 0.0)
+            try:
+                message = job.messages.get(timeout=timeout)
+            except queue.Empty:
+                if started:
+                    return found, deviations, True
+                if self._withdraw(job):
+                    POOL_REJECTED.inc(reason='expired')
+                    raise PoolBusy("Timed out waiting for a solver worker")
+                # A feeder took it just now; its "started" message is on the way
+                started = True
+                continue
+            kind = message[0]
+            if kind == "started":
+                started = True
+                if stats is not None:
+                    stats.add("queue", message[1])
+            elif kind == "solution":
+                found.append(message[1])
+                deviations.append(message[2])
+                if on_solution:
+                    on_solution(message[1], message[2])
+            elif kind == "done":
+                _, ranking, deviations, partial, worker_stats = message
+                if stats is not None:
+                    stats.merge(worker_stats)
+                return [found[i] for i in ranking], deviations, partial
+            else:
+                raise message[1]
+
+    def _withdraw(self, job):
+        """Take a job back out of the queue; False if a feeder already took it."""
+        with self._cond:
+            remaining = [entry for entry in self._queue if entry[2] is not job]
+            if len(remaining) == len(self._queue):
+                return False
+            self._queue = remaining
+            heapq.heapify(self._queue)
+            return True
+
+    def _start_worker(self):
+        """A started, warmed-up worker process and its end of the pipe, or (None, None) if it died warming up."""
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn, self.warm), daemon=True)
+        process.start()
+        child_conn.close()
+        try:
+            conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            return None, None
+        return process, conn
+
+    def _next_job(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue)
+            _, _, job = heapq.heappop(self._queue)
+            return job
+
+    def _feed(self):
+        process, conn = None, None
+        while True:
+            if process is None:
+                process, conn = self._start_worker()
+                if process is None:
+                    time.sleep(RESTART_DELAY_SECONDS)
+                    continue
+
+            job = self._next_job()
+            if job.task.expires_at is not None and time.time() >= job.task.expires_at:
+                POOL_REJECTED.inc(reason='expired')
+                job.messages.put(("error", PoolBusy("Timed out waiting for a solver worker")))
+                continue
+            waited = time.monotonic() - job.submitted
+            POOL_QUEUE_SECONDS.observe(waited, priority=PRIORITY_NAMES[job.priority])
+            job.messages.put(("started", waited))
+
+            with self._cond:
+                self._busy += 1
+            try:
+                conn.send(job.task)
+                while True:
+                    message = conn.recv()
+                    job.messages.put(message)
+                    if message[0] != "solution":
+                        break
+            except (EOFError, OSError):
+                job.messages.put(("error", RuntimeError("Solver worker exited during the solve")))
+                conn.close()
+                process.join(timeout=1)
+                process, conn = None, None
+            finally:
+                with self._cond:
+                    self._busy -= 1
@@ -0,0 +1,111 @@
+"""
+Per-request timing: where a request spent its time, as a Server-Timing header
+and one structured JSON log line on stderr.
+
+Handlers get a timer from request_timer() and wrap their stages in
+timer.span(name); solver internals are collected by main.SolveStats and
+merged in with add_solve(). Set REQUEST_TIMING=0 to turn it off: the timer
+is then a NullTimer whose methods do nothing.
+"""
+
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+import json
+import os
+import sys
+import time
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '1') != '0'
+
+# Individual CBC calls listed in the header; the log line always has all of them
+MAX_HEADER_CBC_CALLS = 20
+
+
+class RequestTimer:
+    """Spans recorded for one request, in the order they started."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = perf_counter()
+        self.spans = []  # (name, seconds, description)
+        self.fields = {}  # extra log fields (cache key, status, ...)
+        self.solve = None
+
+    @contextmanager
+    def span(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, perf_counter() - start, None))
+
+    def add(self, name, seconds, description=None):
+        self.spans.append((name, seconds, description))
+
+    def add_solve(self, stats):
+        """Merge a main.SolveStats: its stages as spans, plus one span per CBC call."""
+        self.solve = stats
+        for stage, seconds in stats.stages.items():
+            self.spans.append((stage, seconds, None))
+        for i, seconds in enumerate(stats.cbc_calls[:MAX_HEADER_CBC_CALLS]):
+            self.spans.append(("cbc_call", seconds, f"#{i + 1}"))
+
+    def note(self, **fields):
+        self.fields.update(fields)
+
+    def elapsed(self):
+        return perf_counter() - self.started
+
+    def header(self):
+        """Server-Timing value for everything recorded so far (durations in ms)."""
+        metrics = []
+        for name, seconds, description in self.spans:
+            metric = f"{name};dur={seconds * 1000:.1f}"
+            if description:
+                metric += f';desc="{description}"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def log(self):
+        """Write the request's one JSON log line."""
+        spans = {}
+        for name, seconds, _ in self.spans:
+            if name != "cbc_call":
+                spans[name] = round(spans.get(name, 0.0) + seconds * 1000, 1)
+        entry = {"event": "request", "endpoint": self.endpoint, "time": round(time.time(), 3),
+                 "total_ms": round(self.elapsed() * 1000, 1), **self.fields, "spans_ms": spans}
+        if self.solve is not None:
+            entry["cbc_calls_ms"] = [round(s * 1000, 1) for s in self.solve.cbc_calls]
+            entry["iterations"] = self.solve.iterations
+            entry["duplicates"] = self.solve.duplicates
+        print(json.dumps(entry), file=sys.stderr, flush=True)
+
+
+class NullTimer:
+    """Stands in for RequestTimer when timing is off."""
+
+    def span(self, name):
+        return nullcontext()
+
+    def add(self, name, seconds, description=None):
+        pass
+
+    def add_solve(self, stats):
+        pass
+
+    def note(self, **fields):
+        pass
+
+    def header(self):
+        return None
+
+    def log(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def request_timer(endpoint):
+    return RequestTimer(endpoint) if REQUEST_TIMING else NULL_TIMER
@@ -0,0 +1,296 @@
+"""
+Solver and catalog benchmarks over a fixed corpus, checked against stored baselines.
+
+    python benchmarks/run.py                  # run corpus.json, compare with baseline.json
+    python benchmarks/run.py --update         # run and store the results as the new baseline
+    python benchmarks/run.py --cases exotic   # only the cases whose name contains "exotic"
+
+Every case runs in a fresh interpreter, like a cold function instance: it
+builds its catalog (timed) and solves its target once cold, which also
+builds the lazy per-catalog tables. It then solves it --repeat more times
+warm, as a warm instance would, and keeps the median run. That is done
+--rounds times per case, and each timing is the median over the rounds, so
+one slow run (or one lucky one in the baseline) doesn't decide the result.
+
+A case regresses when a timing grows past baseline * (1 + tolerance) +
+TIME_SLACK_SECONDS, where tolerance is --tolerance, or --cold-tolerance for
+the noisier one-shot cold timings; or when it finds fewer builds, worse ones,
+or runs out of time where the baseline did not. The run then exits with
+status 1.
+
+Timings depend on the machine, so the baseline records the CPU it was taken
+on. Against a baseline from another CPU only the builds are compared (with a
+warning); record a baseline on the machine you compare on. Change corpus.json
+only together with its "version" (and a new baseline).
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "api"))
+
+from main import STAT_NAMES, Deadline, SolveStats, get_piece_catalog, solve_with_milp_multiple
+
+CORPUS_PATH = os.path.join(HERE, "corpus.json")
+BASELINE_PATH = os.path.join(HERE, "baseline.json")
+
+# Timings compared against the baseline
+TIMED_METRICS = ("generation_seconds", "first_solve_seconds", "model_build_seconds", "cbc_seconds",
+                 "total_seconds")
+# Measured once per interpreter, so they only get the median over rounds
+COLD_METRICS = ("generation_seconds", "first_solve_seconds")
+# Absolute allowance on top of the relative tolerance, so millisecond stages don't flap
+TIME_SLACK_SECONDS = 0.05
+# Budget per solve unless a case sets "timeout" (the /api/optimize request budget).
+# Cases that run out of it are still compared on the builds found in that time
+DEFAULT_TIMEOUT_SECONDS = 15
+DEFAULT_MAX_SOLUTIONS = 8
+
+
+@contextmanager
+def quiet_stdout():
+    """Silence CBC, which logs to the inherited stdout file descriptor."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def catalog_options(case):
+    return {
+        "allow_tuned": case.get("allow_tuned", True),
+        "use_exotic": case.get("use_exotic", False),
+        "use_class_item_exotic": case.get("use_class_item_exotic", False),
+        "exotic_perks": tuple(case["exotic_perks"]) if case.get("exotic_perks") else None,
+    }
+
+
+def run_case(case, repeat):
+    """Benchmark one corpus case; returns its metrics."""
+    options = catalog_options(case)
+    start = perf_counter()
+    catalog = get_piece_catalog(**options)
+    generation_seconds = perf_counter() - start
+
+    target = [case["target"].get(stat, 0) for stat in STAT_NAMES]
+    first_solve_seconds = None
+    runs = []
+    for run in range(repeat + 1):
+        stats = SolveStats()
+        deadline = Deadline(case.get("timeout", DEFAULT_TIMEOUT_SECONDS))
+        start = perf_counter()
+        with quiet_stdout():
+            solutions, deviations = solve_with_milp_multiple(
+                target, catalog.piece_types, catalog.piece_stats,
+                max_solutions=case.get("max_solutions", DEFAULT_MAX_SOLUTIONS),
+                allow_tuned=options["allow_tuned"],
+                require_exotic=options["use_exotic"],
+                minimum_constraints=case.get("minimum_constraints"),
+                catalog=catalog,
+                deadline=deadline,
+                stats=stats,
+            )
+        seconds = perf_counter() - start
+        if run == 0:
+            first_solve_seconds = seconds
+            continue
+        runs.append((seconds, stats, solutions, deviations, deadline.partial))
+
+    runs.sort(key=lambda r: r[0])
+    seconds, stats, solutions, deviations, partial = runs[(len(runs) - 1) // 2]
+    return {
+        "catalog_pieces": len(catalog.piece_types),
+        "catalog_representatives": len(catalog.rep_types),
+        "generation_seconds": round(generation_seconds, 4),
+        "first_solve_seconds": round(first_solve_seconds, 4),
+        "model_build_seconds": round(stats.stages.get("model_build", 0.0), 4),
+        "cbc_seconds": round(stats.stages.get("cbc", 0.0), 4),
+        "cbc_calls": [round(s, 4) for s in stats.cbc_calls],
+        "iterations": stats.iterations,
+        "duplicates": stats.duplicates,
+        "stages": {stage: round(s, 4) for stage, s in stats.stages.items()},
+        "total_seconds": round(seconds, 4),
+        "solutions": len(solutions),
+        "best_deviation": round(min(deviations), 4) if deviations else None,
+        "total_deviation": round(sum(deviations), 4),
+        "partial": partial,
+    }
+
+
+def run_case_isolated(case, corpus_path, repeat):
+    """run_case in a fresh interpreter, so no case sees tables warmed up by another."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--corpus", corpus_path,
+                           "--run-case", case["name"], "--repeat", str(repeat)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"case {case['name']} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run_case_rounds(case, corpus_path, repeat, rounds):
+    """run_case_isolated rounds times: the median round by total time, with every timing the median over rounds."""
+    results = sorted((run_case_isolated(case, corpus_path, repeat) for _ in range(rounds)),
+                     key=lambda r: r["total_seconds"])
+    result = dict(results[(len(results) - 1) // 2])
+    for metric in TIMED_METRICS:
+        result[metric] = round(statistics.median(r[metric] for r in results), 4)
+    return result
+
+
+def machine_info():
+    """What the timings depend on: recorded with a baseline, compared before timings are."""
+    cpu_model = None
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_model": cpu_model or platform.processor() or platform.machine(), "cpus": os.cpu_count()}
+
+
+def same_machine(machine, baseline_machine):
+    """Whether timings from baseline_machine can be compared with this one's."""
+    return all(machine.get(key) == baseline_machine.get(key) for key in ("cpu_model", "cpus"))
+
+
+def regressions(result, baseline, tolerance, cold_tolerance, compare_timings=True):
+    """Human-readable reasons result is worse than baseline (empty if it isn't)."""
+    problems = []
+    for metric in TIMED_METRICS if compare_timings else ():
+        relative = cold_tolerance if metric in COLD_METRICS else tolerance
+        allowed = baseline[metric] * (1 + relative) + TIME_SLACK_SECONDS
+        if result[metric] > allowed:
+            problems.append(f"{metric} {result[metric]:.3f}s > {allowed:.3f}s (baseline {baseline[metric]:.3f}s)")
+    if result["solutions"] < baseline["solutions"]:
+        problems.append(f"{result['solutions']} solutions, baseline found {baseline['solutions']}")
+    for metric in ("best_deviation", "total_deviation"):
+        if baseline[metric] is not None and (result[metric] is None or result[metric] > baseline[metric] + 1e-6):
+            problems.append(f"{metric} {result[metric]} > baseline {baseline[metric]}")
+    if result["partial"] and not baseline["partial"]:
+        problems.append("ran out of time (baseline finished)")
+    return problems
+
+
+def print_row(name, result, status):
+    best = "-" if result["best_deviation"] is None else f"{result['best_deviation']:.2f}"
+    print(f"{name:<32} {result['catalog_pieces']:>6} {result['generation_seconds'] * 1000:>8.0f} "
+          f"{result['first_solve_seconds'] * 1000:>8.0f} "
+          f"{result['model_build_seconds'] * 1000:>8.0f} {len(result['cbc_calls']):>4} "
+          f"{result['cbc_seconds'] * 1000:>8.0f} {result['iterations']:>5} {result['duplicates']:>4} "
+          f"{result['total_seconds'] * 1000:>8.0f} {result['solutions']:>4} {best:>8}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the solver against corpus.json")
+    parser.add_argument("--update", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--cases", help="only run cases whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="warm solves per round; the median is kept")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="fresh interpreters per case; timings are the median over them")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown (0.5 = +50%%)")
+    parser.add_argument("--cold-tolerance", type=float, default=1.0,
+                        help="allowed relative slowdown of the cold (once per round) timings")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--output", help="also write this run's results as JSON to this path")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)  # one case, in this process; prints its JSON
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    if args.run_case:
+        case = next(c for c in corpus["cases"] if c["name"] == args.run_case)
+        print(json.dumps(run_case(case, args.repeat)))
+        return 0
+    cases = [c for c in corpus["cases"] if not args.cases or args.cases in c["name"]]
+    if args.repeat < 1 or args.rounds < 1:
+        parser.error("--repeat and --rounds must be at least 1")
+    machine = machine_info()
+
+    baseline = None
+    if not args.update:
+        try:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}; run with --update to record one", file=sys.stderr)
+        if baseline and baseline.get("corpus_version") != corpus["version"]:
+            print(f"Baseline is for corpus version {baseline.get('corpus_version')}, corpus is "
+                  f"{corpus['version']}; run with --update to record a new one", file=sys.stderr)
+            return 2
+    compare_timings = True
+    if baseline and not same_machine(machine, baseline.get("machine", {})):
+        recorded = baseline.get("machine", {})
+        print(f"Baseline was recorded on {recorded.get('cpu_model', 'an unrecorded CPU')} "
+              f"({recorded.get('cpus')} CPUs), this is {machine['cpu_model']} ({machine['cpus']} CPUs): "
+              f"comparing builds only; run with --update to record timings here", file=sys.stderr)
+        compare_timings = False
+
+    print(f"{'case':<32} {'pieces':>6} {'gen ms':>8} {'cold ms':>8} {'build ms':>8} {'cbc':>4} {'cbc ms':>8} "
+          f"{'iters':>5} {'dups':>4} {'total ms':>8} {'sols':>4} {'best dev':>8}")
+    results = {}
+    failed = []
+    for case in cases:
+        result = results[case["name"]] = run_case_rounds(case, args.corpus, args.repeat, args.rounds)
+        base = baseline["results"].get(case["name"]) if baseline else None
+        problems = regressions(result, base, args.tolerance, args.cold_tolerance, compare_timings) if base else []
+        status = "FAIL" if problems else ("ok" if base else "new")
+        if result["partial"]:
+            status += " (partial)"
+        print_row(case["name"], result, status)
+        for problem in problems:
+            print(f"    {problem}")
+        if problems:
+            failed.append(case["name"])
+
+    run = {
+        "corpus_version": corpus["version"],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": machine,
+        "repeat": args.repeat,
+        "rounds": args.rounds,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+    if args.update:
+        if args.cases and os.path.exists(args.baseline):
+            # Refresh only the selected cases
+            with open(args.baseline, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("corpus_version") == corpus["version"]:
+                run["results"] = dict(stored["results"], **results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if failed:
+        print(f"{len(failed)} of {len(cases)} cases regressed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())